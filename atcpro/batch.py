@@ -0,0 +1,139 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+def read_users(users, users_file=None):
+    """
+    コマンドラインのユーザーと、ファイル(1行に1ユーザー、#以降はコメント)のユーザー(重複は除く)
+    """
+    ret = list(users)
+    if users_file is not None:
+        with open(users_file, encoding="utf-8") as f:
+            for line in f:
+                user = line.split("#")[0].strip()
+                if user:
+                    ret.append(user)
+    return list(dict.fromkeys(ret))
+
+def recommend_user(user, catalog, N=10):
+    """
+    1ユーザー分のおすすめ問題を作る(各処理の時間も返す)
+    """
+    from main import get_histories, get_submissions_merge_contest_info, recomend_from_submissions
+
+    timings = {}
+    start = time.perf_counter()
+    histories = get_histories(user, N=N)
+    timings["histories"] = time.perf_counter() - start
+
+    stage_start = time.perf_counter()
+    submissions = get_submissions_merge_contest_info(user, histories=histories, catalog=catalog)
+    timings["submissions"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    recomends = recomend_from_submissions(submissions, catalog, histories=histories)
+    timings["recomends"] = time.perf_counter() - stage_start
+
+    problems = []
+    for problem_id, score in recomends:
+        card = catalog.card(problem_id)
+        problems.append({
+            "problem_id": problem_id,
+            "score": score,
+            "name": None if card is None else card[1],
+            "diff": None if card is None else card[2],
+            "url": None if card is None else card[3],
+        })
+    return {
+        "user": user,
+        "contests": len(histories),
+        "recomends": problems,
+        "timings": {name: round(elapsed, 3) for name, elapsed in timings.items()},
+        "elapsed": round(time.perf_counter() - start, 3),
+    }
+
+def run_batch(users, out, workers=4, N=10):
+    """
+    複数ユーザーのおすすめ問題を並列に作り、できたものから1行ずつJSONで書き出す
+    類似度インデックスとカタログは最初に1回だけ読み込んで共有する
+    通信は共有のTransportを通るので、ホストごとのレート制限は全ワーカーで共有される
+    return 集計(件数、処理時間、スループット)
+    """
+    from main import get_catalog
+    from similarity import get_similarity_index
+    from transport import get_transport
+
+    start = time.perf_counter()
+    catalog = get_catalog()
+    get_similarity_index()
+    load_time = time.perf_counter() - start
+
+    queue = iter(users)
+    in_flight = {}
+    elapsed_list = []
+    failed = 0
+
+    def submit(executor):
+        for user in queue:
+            in_flight[executor.submit(recommend_user, user, catalog, N)] = user
+            return True
+        return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers * 2):
+            if not submit(executor):
+                break
+        while in_flight:
+            done, _pending = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                user = in_flight.pop(future)
+                try:
+                    result = future.result()
+                    elapsed_list.append(result["elapsed"])
+                except Exception as e:
+                    failed += 1
+                    result = {"user": user, "error": str(e)}
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                submit(executor)
+
+    elapsed = time.perf_counter() - start
+    elapsed_list.sort()
+    return {
+        "users": len(users),
+        "ok": len(users) - failed,
+        "failed": failed,
+        "load": round(load_time, 3),
+        "elapsed": round(elapsed, 3),
+        "users_per_second": round(len(users) / elapsed, 3) if elapsed > 0 else 0.0,
+        "user_p50": elapsed_list[len(elapsed_list) // 2] if elapsed_list else None,
+        "user_max": elapsed_list[-1] if elapsed_list else None,
+        "transport": get_transport().stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="複数ユーザーのおすすめ問題をJSONLで書き出す")
+    parser.add_argument("users", nargs="*", help="ユーザーID")
+    parser.add_argument("--users-file", help="ユーザーIDのファイル(1行に1ユーザー)")
+    parser.add_argument("-o", "--output", help="書き出すファイル(省略すると標準出力)")
+    parser.add_argument("--workers", type=int, default=4, help="同時に処理するユーザー数")
+    parser.add_argument("-N", type=int, default=10, help="使用する直近のコンテスト数")
+    args = parser.parse_args()
+
+    users = read_users(args.users, args.users_file)
+    if len(users) == 0:
+        parser.error("ユーザーを指定してください。")
+
+    out = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8")
+    try:
+        summary = run_batch(users, out, workers=args.workers, N=args.N)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    # 集計はJSONLと混ざらないように標準エラー出力に出す(ライブラリ側の診断メッセージも標準エラー出力)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
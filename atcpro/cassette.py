@@ -0,0 +1,159 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+CASSETTE_DIR = "data/cassettes" # 環境変数CASSETTE_DIRで変更できる
+CASSETTE_LATENCY = "recorded" # 再生時の待ち時間 recorded(記録した時間) | 秒数(環境変数CASSETTE_LATENCYで変更できる)
+SECRET_PARAMS = ("key",) # 記録しないクエリパラメータ(GeminiのAPIキー)
+# 本文は展開して保存するので、圧縮・長さのヘッダーは記録しない
+SKIP_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie")
+
+def strip_secrets(url):
+    """
+    urlからSECRET_PARAMSを除く
+    """
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not key in SECRET_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+class Cassette:
+    """
+    通信を記録・再生する(Transportから使う)
+    - record: 実際の通信のレスポンスを保存する
+    - replay: 保存したレスポンスを返す(通信しない)。ないものはConnectionError
+    リクエストは メソッド, URL(APIキーを除く), パラメータ, 本文 で区別する
+    記録・再生時はローカルのキャッシュを使わないので(bypass_caches)、どのデータディレクトリでも同じリクエストになる
+    """
+
+    def __init__(self, mode, path=None, latency=None):
+        if not mode in ("record", "replay"):
+            raise ValueError(f"未定義のモードです: {mode}")
+        self.mode = mode
+        self.path = f"{MODULE_PATH}/{path or os.getenv('CASSETTE_DIR', CASSETTE_DIR)}"
+        latency = os.getenv("CASSETTE_LATENCY", CASSETTE_LATENCY) if latency is None else latency
+        self.latency = None if latency == "recorded" else float(latency)
+        self.lock = threading.Lock()
+        self.counters = {"recorded": 0, "replayed": 0, "missed": 0}
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(method, url, params=None, data=None):
+        url = strip_secrets(url)
+        if params:
+            url = f"{url}{'&' if urlsplit(url).query else '?'}{urlencode(sorted(params.items()))}"
+        body = b"" if data is None else data.encode("utf-8") if isinstance(data, str) else data
+        digest = hashlib.sha256(f"{method} {url}\n".encode("utf-8") + body).hexdigest()
+        return url, digest
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def record(self, method, url, kwargs, res, elapsed):
+        """
+        レスポンスを保存する(ストリームのレスポンスも本文を読み切ってから返す)
+        条件付きリクエストの304は本文がないので、保存済みの記録を残す
+        """
+        if res.status_code == 304:
+            return res
+        full_url, key = self.key(method, url, kwargs.get("params"), kwargs.get("data"))
+        content = res.content
+        with gzip.open(f"{self.path}/{key}.body.gz.tmp", "wb") as f:
+            f.write(content)
+        os.replace(f"{self.path}/{key}.body.gz.tmp", f"{self.path}/{key}.body.gz")
+        meta = {
+            "method": method,
+            "url": full_url,
+            "status": res.status_code,
+            "headers": {name: value for name, value in res.headers.items() if not name.lower() in SKIP_HEADERS},
+            "encoding": res.encoding,
+            "elapsed": elapsed,
+        }
+        with open(f"{self.path}/{key}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(f"{self.path}/{key}.json.tmp", f"{self.path}/{key}.json")
+        self.count("recorded")
+        return res
+
+    def replay(self, method, url, kwargs):
+        """
+        保存したレスポンスを、記録した時間(またはlatency秒)待ってから返す
+        """
+        full_url, key = self.key(method, url, kwargs.get("params"), kwargs.get("data"))
+        try:
+            with open(f"{self.path}/{key}.json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with gzip.open(f"{self.path}/{key}.body.gz", "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            self.count("missed")
+            raise requests.exceptions.ConnectionError(f"記録がありません: {method} {full_url}")
+        time.sleep(meta["elapsed"] if self.latency is None else self.latency)
+
+        res = requests.Response()
+        res.status_code = meta["status"]
+        res.headers = CaseInsensitiveDict(meta["headers"])
+        res.encoding = meta["encoding"]
+        res.url = full_url
+        res.reason = "Replayed"
+        # 読み込み済みの扱いにして、iter_lines/iter_contentも本文から返す
+        res._content = content
+        res._content_consumed = True
+        self.count("replayed")
+        return res
+
+    def entries(self):
+        """
+        保存済みの記録 [(メソッド, URL, ステータス, 本文のバイト数, 記録した時間)]
+        """
+        ret = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".json"):
+                continue
+            with open(f"{self.path}/{name}", encoding="utf-8") as f:
+                meta = json.load(f)
+            size = os.path.getsize(f"{self.path}/{name[:-len('.json')]}.body.gz")
+            ret.append((meta["method"], meta["url"], meta["status"], size, meta["elapsed"]))
+        return ret
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+def bypass_caches():
+    """
+    記録・再生時はTrue。ローカルのキャッシュ(HTTPキャッシュ、Geminiの回答、コンテスト履歴・提出の保存済みの範囲)を使わずに毎回通信する
+    キャッシュの状態によって送るリクエストが変わると、記録したときと別のデータディレクトリで再生できないため
+    """
+    return os.getenv("TRANSPORT_MODE", "live") != "live"
+
+def get_cassette():
+    """
+    環境変数TRANSPORT_MODE(live | record | replay)に応じたCassette(liveならNone)
+    """
+    mode = os.getenv("TRANSPORT_MODE", "live")
+    if mode == "live":
+        return None
+    return Cassette(mode)
+
+def main():
+    parser = argparse.ArgumentParser(description="記録した通信の一覧")
+    parser.add_argument("--dir", default=None, help=f"記録のディレクトリ(省略すると{CASSETTE_DIR})")
+    args = parser.parse_args()
+
+    cassette = Cassette("replay", path=args.dir)
+    entries = cassette.entries()
+    for method, url, status, size, elapsed in entries:
+        print(f"{method} {status} {elapsed * 1000:7.1f}ms {size / 1024:8.1f}KB {url}")
+    print(f"{len(entries)} entries, {sum(entry[3] for entry in entries) / 1024 / 1024:.1f}MB, {sum(entry[4] for entry in entries):.1f}s recorded")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from similarity import DIFFICULTY_MISSING, DIFFICULTY_NONE, DIFFICULTY_VALUE
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+CATALOG_PATH = "data/catalog.npz"
+
+def pack_strings(strings):
+    """
+    文字列のリストを1つのバイト列(uint8の配列)にまとめる
+    """
+    return np.frombuffer("\0".join(strings).encode("utf-8"), dtype=np.uint8)
+
+def unpack_strings(array, count):
+    if count == 0:
+        return []
+    return array.tobytes().decode("utf-8").split("\0")
+
+class Catalog:
+    """
+    問題・コンテスト・難易度の情報をまとめたもの
+    IDは番号に置き換え、数値は型付きの配列で持つ(文字列はID・問題名のみ保持する)
+    - コンテスト: contest_ids, contest_start, contest_duration
+      (先頭n_contestsがコンテスト情報にあるもの。残りは問題からのみ参照されているもの)
+    - 問題: problem_ids, problem_names, problem_contest(コンテストの番号), point, difficulty, difficulty_status(DIFFICULTY_*)
+      (先頭n_problemsが問題情報にあるもの。残りは難易度のみあるもの)
+    """
+
+    def __init__(self, contest_ids, contest_start, contest_duration, n_contests, problem_ids, problem_names, problem_contest, point, difficulty, difficulty_status, n_problems, sources=None):
+        self.contest_ids = contest_ids
+        self.contest_index = {contest_id: i for i, contest_id in enumerate(contest_ids)}
+        self.contest_start = contest_start
+        self.contest_duration = contest_duration
+        self.n_contests = n_contests
+        self.problem_ids = problem_ids
+        self.problem_index = {problem_id: i for i, problem_id in enumerate(problem_ids)}
+        self.problem_names = problem_names
+        self.problem_contest = problem_contest
+        self.point = point
+        self.difficulty = difficulty
+        self.difficulty_status = difficulty_status
+        self.n_problems = n_problems
+        self.sources = sources # 元にしたデータの版(スナップショットが古くなったかの判定用)
+
+    @classmethod
+    def from_json(cls, contests, problems, difficulty, sources=None):
+        """
+        kenkooooのcontests.json, merged-problems.json, problem-models.jsonから作る
+        """
+        contest_ids = [contest["id"] for contest in contests]
+        contest_start = [int(contest["start_epoch_second"]) for contest in contests]
+        contest_duration = [int(contest["duration_second"]) for contest in contests]
+        contest_index = {contest_id: i for i, contest_id in enumerate(contest_ids)}
+        n_contests = len(contest_ids)
+
+        problem_ids = [problem["id"] for problem in problems]
+        problem_names = [problem["name"] for problem in problems]
+        problem_contest = []
+        point = []
+        for problem in problems:
+            contest_id = problem.get("contest_id")
+            if contest_id is None:
+                problem_contest.append(-1)
+            else:
+                if not contest_id in contest_index:
+                    contest_index[contest_id] = len(contest_ids)
+                    contest_ids.append(contest_id)
+                    contest_start.append(-1)
+                    contest_duration.append(0)
+                problem_contest.append(contest_index[contest_id])
+            point.append(np.nan if problem.get("point") is None else problem["point"])
+        n_problems = len(problem_ids)
+
+        # 難易度のみある問題も含める
+        listed = set(problem_ids)
+        for problem_id in difficulty:
+            if not problem_id in listed:
+                problem_ids.append(problem_id)
+                problem_names.append("")
+                problem_contest.append(-1)
+                point.append(np.nan)
+
+        values = np.zeros(len(problem_ids), dtype=np.float64)
+        status = np.full(len(problem_ids), DIFFICULTY_MISSING, dtype=np.int8)
+        for i, problem_id in enumerate(problem_ids):
+            model = difficulty.get(problem_id)
+            if model is None or not "difficulty" in model:
+                continue
+            if model["difficulty"] is None:
+                status[i] = DIFFICULTY_NONE
+            else:
+                values[i] = model["difficulty"]
+                status[i] = DIFFICULTY_VALUE
+
+        return cls(
+            contest_ids,
+            np.array(contest_start, dtype=np.int64),
+            np.array(contest_duration, dtype=np.int64),
+            n_contests,
+            problem_ids,
+            problem_names,
+            np.array(problem_contest, dtype=np.int32),
+            np.array(point, dtype=np.float32),
+            values,
+            status,
+            n_problems,
+            sources=sources
+        )
+
+    def save(self, path=CATALOG_PATH):
+        """
+        スナップショットを保存する(一時ファイルに書き込んでから置き換える)
+        """
+        path = f"{MODULE_PATH}/{path}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = {
+            "n_contests": self.n_contests,
+            "n_problems": self.n_problems,
+            "contest_count": len(self.contest_ids),
+            "problem_count": len(self.problem_ids),
+            "sources": self.sources,
+        }
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(
+                f,
+                meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                contest_ids=pack_strings(self.contest_ids),
+                contest_start=self.contest_start,
+                contest_duration=self.contest_duration,
+                problem_ids=pack_strings(self.problem_ids),
+                problem_names=pack_strings(self.problem_names),
+                problem_contest=self.problem_contest,
+                point=self.point,
+                difficulty=self.difficulty,
+                difficulty_status=self.difficulty_status,
+            )
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH):
+        with np.load(f"{MODULE_PATH}/{path}") as f:
+            meta = json.loads(f["meta"].tobytes().decode("utf-8"))
+            return cls(
+                unpack_strings(f["contest_ids"], meta["contest_count"]),
+                f["contest_start"],
+                f["contest_duration"],
+                meta["n_contests"],
+                unpack_strings(f["problem_ids"], meta["problem_count"]),
+                unpack_strings(f["problem_names"], meta["problem_count"]),
+                f["problem_contest"],
+                f["point"],
+                f["difficulty"],
+                f["difficulty_status"],
+                meta["n_problems"],
+                sources=meta["sources"]
+            )
+
+    @staticmethod
+    def exists(path=CATALOG_PATH):
+        return os.path.exists(f"{MODULE_PATH}/{path}")
+
+    def nbytes(self):
+        """
+        配列と文字列が使うおおよそのバイト数
+        """
+        arrays = (self.contest_start, self.contest_duration, self.problem_contest, self.point, self.difficulty, self.difficulty_status)
+        strings = self.contest_ids + self.problem_ids + self.problem_names
+        return sum(array.nbytes for array in arrays) + sum(len(string.encode("utf-8")) for string in strings)
+
+    def __contains__(self, contest_id):
+        """
+        コンテスト情報にあるコンテストか
+        """
+        i = self.contest_index.get(contest_id)
+        return i is not None and i < self.n_contests
+
+    def window(self, contest_id):
+        """
+        contest_idの(開始時刻, 終了時刻)。存在しない場合None
+        """
+        i = self.contest_index.get(contest_id)
+        if i is None or i >= self.n_contests:
+            return None
+        return int(self.contest_start[i]), int(self.contest_start[i] + self.contest_duration[i])
+
+    def problem_rows(self, problem_ids):
+        """
+        各問題の番号の配列(存在しない場合-1)
+        """
+        return np.fromiter((self.problem_index.get(str(problem_id), -1) for problem_id in problem_ids), dtype=np.int64, count=len(problem_ids))
+
+    def difficulty_arrays(self, rows):
+        """
+        問題の番号(problem_rowsの結果)に揃えた難易度の配列と状態の配列(DIFFICULTY_*)を返す
+        """
+        found = rows >= 0
+        values = np.where(found, self.difficulty[rows], 0.0)
+        status = np.where(found, self.difficulty_status[rows], DIFFICULTY_MISSING).astype(np.int8)
+        return values, status
+
+    def problem_start(self):
+        """
+        問題情報にある各問題のコンテストの開始時刻(コンテスト情報にない場合-1)
+        """
+        contest = self.problem_contest[:self.n_problems]
+        start = np.full(self.n_problems, -1, dtype=np.int64)
+        known = (contest >= 0) & (contest < self.n_contests)
+        start[known] = self.contest_start[contest[known]]
+        return start
+
+    def card(self, problem_id):
+        """
+        おすすめ問題カードに表示する(problem_id, name, diff, url)。問題情報にない場合None
+        """
+        i = self.problem_index.get(problem_id)
+        if i is None or i >= self.n_problems:
+            return None
+        diff = 0
+        if self.difficulty_status[i] == DIFFICULTY_VALUE:
+            diff = float(self.difficulty[i])
+            diff = int(diff) if diff.is_integer() else diff
+        contest = self.problem_contest[i]
+        url = f"https://atcoder.jp/contests/{self.contest_ids[contest]}/tasks/{problem_id}" if contest >= 0 else ""
+        return problem_id, self.problem_names[i], diff, url
+
+def join_submissions(submissions, windows):
+    """
+    提出をコンテスト期間に割り当てる
+    submissions: epoch_secondの昇順に並んだ提出
+    windows: (contest_id, start, end)[]
+    return { contest_id: submission[] } (start <= epoch_second <= end かつ contest_idが一致する提出)
+    """
+    epochs = np.fromiter((submission["epoch_second"] for submission in submissions), dtype=np.int64, count=len(submissions))
+    starts = np.array([window[1] for window in windows], dtype=np.int64)
+    ends = np.array([window[2] for window in windows], dtype=np.int64)
+    lo = np.searchsorted(epochs, starts, side="left")
+    hi = np.searchsorted(epochs, ends, side="right")
+
+    ret = {}
+    for (contest_id, _start, _end), l, h in zip(windows, lo, hi):
+        ret[contest_id] = [submission for submission in submissions[l:h] if submission["contest_id"] == contest_id]
+    return ret
+
+def main():
+    parser = argparse.ArgumentParser(description="問題・コンテスト・難易度のカタログ")
+    parser.add_argument("command", choices=("rebuild", "status"))
+    args = parser.parse_args()
+
+    from main import get_catalog, get_contests_information, get_detailed_problems_information, get_difficulties
+
+    if args.command == "rebuild":
+        start = time.perf_counter()
+        catalog = get_catalog(refresh=True)
+        print(f"rebuild: {catalog.n_problems} problems, {catalog.n_contests} contests ({time.perf_counter() - start:.2f}s)")
+    elif args.command == "status":
+        if not Catalog.exists():
+            print("スナップショットがありません。")
+            return
+        start = time.perf_counter()
+        catalog = Catalog.load()
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        raw = (get_contests_information(), get_detailed_problems_information(), get_difficulties())
+        json_time = time.perf_counter() - start
+        json_size = sum(len(json.dumps(data, ensure_ascii=False).encode("utf-8")) for data in raw)
+        print(f"problems: {catalog.n_problems} (+{len(catalog.problem_ids) - catalog.n_problems} difficulty only), contests: {catalog.n_contests}")
+        print(f"snapshot: {os.path.getsize(f'{MODULE_PATH}/{CATALOG_PATH}')} bytes, load {load_time * 1000:.1f}ms, memory ~{catalog.nbytes()} bytes")
+        print(f"json: {json_size} bytes, load {json_time * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
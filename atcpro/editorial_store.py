@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+EDITORIAL_DB_PATH = "data/editorials.sqlite3"
+LEGACY_JSON_PATH = "data/problems_editorial.json"
+EDITORIAL_COMPRESS = True # 解説テキストをzlibで圧縮して保存する(環境変数EDITORIAL_COMPRESS=0で無効)
+EDITORIAL_PREPROCESS = False # 解説テキストを前処理してから保存する(環境変数EDITORIAL_PREPROCESS=1で有効)
+
+class EditorialStore:
+    """
+    解説テキストとコードの保存先(SQLite)
+    problem_id -> { text, codes } (解説が存在しない問題はNone)
+    テキスト(editorial_texts)とコード(editorial_codes)は別のテーブルに保存し、
+    類似度やプロンプトの作成ではテキストのみを読み込む
+    """
+
+    def __init__(self, path=EDITORIAL_DB_PATH, compress=None, preprocess=None):
+        self.path = f"{MODULE_PATH}/{path}"
+        self.compress = os.getenv("EDITORIAL_COMPRESS", "1" if EDITORIAL_COMPRESS else "0") != "0" if compress is None else compress
+        self.preprocess = os.getenv("EDITORIAL_PREPROCESS", "1" if EDITORIAL_PREPROCESS else "0") != "0" if preprocess is None else preprocess
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.transaction() as conn:
+            # text: 文字列、または圧縮したバイト列
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS editorial_texts (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    text BLOB
+                )
+            """)
+            # codes: 圧縮したJSON
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS editorial_codes (
+                    id TEXT PRIMARY KEY,
+                    codes BLOB NOT NULL
+                )
+            """)
+            self.migrate(conn)
+
+    def migrate(self, conn):
+        """
+        テキストとコードを1つのテーブル(editorials)に保存していた形式から移行する
+        (書き込み番号はそのまま残すので類似度インデックスは作り直さない)
+        """
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'editorials'").fetchone()
+        if exists is None:
+            return
+        for seq, problem_id, text, codes in conn.execute("SELECT seq, id, text, codes FROM editorials ORDER BY seq").fetchall():
+            data = _to_data(text, codes)
+            self._insert(conn, problem_id, data, seq=seq)
+        conn.execute("DROP TABLE editorials")
+
+    def connection(self):
+        """
+        スレッドごとのコネクション
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+    def __contains__(self, problem_id):
+        row = self.connection().execute("SELECT 1 FROM editorial_texts WHERE id = ?", (problem_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM editorial_texts").fetchone()[0]
+
+    def get(self, problem_id):
+        """
+        problem_idの解説(存在しない場合None)
+        """
+        text = self.get_text(problem_id)
+        if text is None:
+            return None
+        return {"text": text, "codes": self.get_codes(problem_id)}
+
+    def get_text(self, problem_id):
+        """
+        problem_idの解説テキストのみ(存在しない場合None)
+        """
+        row = self.connection().execute("SELECT text FROM editorial_texts WHERE id = ?", (problem_id,)).fetchone()
+        if row is None:
+            return None
+        return _decode_text(row[0])
+
+    def get_codes(self, problem_id):
+        """
+        problem_idの解説のコード(存在しない場合は空のリスト)
+        """
+        row = self.connection().execute("SELECT codes FROM editorial_codes WHERE id = ?", (problem_id,)).fetchone()
+        if row is None:
+            return []
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def ids(self):
+        return {row[0] for row in self.connection().execute("SELECT id FROM editorial_texts")}
+
+    def put(self, problem_id, data):
+        """
+        解説を1件保存する(1件ごとにコミット)
+        """
+        self.put_many([(problem_id, data)])
+
+    def put_many(self, items):
+        """
+        解説をまとめて保存する(まとめて1回コミット)
+        items: (problem_id, data)[]
+        """
+        with self.transaction() as conn:
+            for problem_id, data in items:
+                self._insert(conn, problem_id, data)
+
+    def _insert(self, conn, problem_id, data, seq=None):
+        text = None
+        if data is not None:
+            text = data["text"]
+            if self.preprocess:
+                from similarity import preprocess_text
+                text = preprocess_text(text)
+            if self.compress:
+                text = zlib.compress(text.encode("utf-8"))
+        if seq is None:
+            # 置き換える場合も書き込み番号を新しくする(類似度インデックスの更新の検知用)
+            conn.execute("DELETE FROM editorial_texts WHERE id = ?", (problem_id,))
+            conn.execute("INSERT INTO editorial_texts (id, text) VALUES (?, ?)", (problem_id, text))
+        else:
+            conn.execute("INSERT OR REPLACE INTO editorial_texts (seq, id, text) VALUES (?, ?, ?)", (seq, problem_id, text))
+        if data is None or len(data["codes"]) == 0:
+            conn.execute("DELETE FROM editorial_codes WHERE id = ?", (problem_id,))
+        else:
+            codes = zlib.compress(json.dumps(data["codes"], ensure_ascii=False).encode("utf-8"))
+            conn.execute("INSERT OR REPLACE INTO editorial_codes (id, codes) VALUES (?, ?)", (problem_id, codes))
+
+    def items(self):
+        """
+        (problem_id, data)を保存順に返すイテレータ
+        """
+        rows = self.connection().execute("""
+            SELECT t.id, t.text, c.codes FROM editorial_texts AS t LEFT JOIN editorial_codes AS c ON t.id = c.id ORDER BY t.seq
+        """)
+        for problem_id, text, codes in rows:
+            if text is None:
+                yield problem_id, None
+            else:
+                yield problem_id, {"text": _decode_text(text), "codes": [] if codes is None else json.loads(zlib.decompress(codes).decode("utf-8"))}
+
+    def iter_texts(self):
+        """
+        (problem_id, text)を保存順に返すイテレータ(解説が存在しない問題は除く)
+        """
+        rows = self.connection().execute("SELECT id, text FROM editorial_texts WHERE text IS NOT NULL ORDER BY seq")
+        yield from ((problem_id, _decode_text(text)) for problem_id, text in rows)
+
+    def fingerprint(self):
+        """
+        更新を検知するための情報(件数と最後の書き込み番号)
+        """
+        count, last_seq = self.connection().execute("SELECT COUNT(*), MAX(seq) FROM editorial_texts").fetchone()
+        return {"count": count, "last_seq": last_seq}
+
+    def import_json(self, path=LEGACY_JSON_PATH):
+        """
+        旧形式のJsonファイルを取り込む
+        """
+        with open(f"{MODULE_PATH}/{path}", encoding="utf-8") as f:
+            problems_json = json.load(f)
+        self.put_many(problems_json.items())
+        return len(problems_json)
+
+    def export_json(self, path=LEGACY_JSON_PATH):
+        """
+        旧形式のJsonファイルに書き出す(一時ファイルに書き込んでから置き換える)
+        """
+        export_path = f"{MODULE_PATH}/{path}"
+        with open(f"{export_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(dict(self.items()), f, ensure_ascii=False, indent=4)
+        os.replace(f"{export_path}.tmp", export_path)
+
+class _Transaction:
+    """
+    BEGIN ~ COMMIT(例外時はROLLBACK)
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+def _decode_text(text):
+    if isinstance(text, bytes):
+        return zlib.decompress(text).decode("utf-8")
+    return text
+
+def _to_data(text, codes):
+    if text is None:
+        return None
+    return {"text": text, "codes": json.loads(codes)}
+
+_store = None
+def get_editorial_store():
+    """
+    解説の保存先を取得する(初回は旧形式のJsonファイルを取り込む)
+    """
+    global _store
+    if _store is None:
+        _store = EditorialStore()
+        if len(_store) == 0 and os.path.exists(f"{MODULE_PATH}/{LEGACY_JSON_PATH}"):
+            _store.import_json()
+    return _store
+
+def main():
+    parser = argparse.ArgumentParser(description="解説データの保存先")
+    parser.add_argument("command", choices=("import", "export", "status"))
+    parser.add_argument("--path", default=LEGACY_JSON_PATH, help="旧形式のJsonファイル")
+    args = parser.parse_args()
+
+    store = EditorialStore()
+    if args.command == "import":
+        print(f"import: {store.import_json(args.path)} problems")
+    elif args.command == "export":
+        store.export_json(args.path)
+        print(f"export: {len(store)} problems -> {args.path}")
+    elif args.command == "status":
+        conn = store.connection()
+        text_size = conn.execute("SELECT COALESCE(SUM(LENGTH(text)), 0) FROM editorial_texts").fetchone()[0]
+        code_size = conn.execute("SELECT COALESCE(SUM(LENGTH(codes)), 0) FROM editorial_codes").fetchone()[0]
+        print(f"problems: {len(store)}, fingerprint: {store.fingerprint()}")
+        print(f"texts: {text_size} bytes, codes: {code_size} bytes (compress: {store.compress}, preprocess: {store.preprocess})")
+
+if __name__ == "__main__":
+    main()
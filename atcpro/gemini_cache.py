@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+GEMINI_CACHE_PATH = "data/gemini_cache.sqlite3"
+GEMINI_CACHE_MAX_ENTRIES = 500 # 環境変数GEMINI_CACHE_MAX_ENTRIESで変更できる
+GEMINI_CACHE_TTL = 0 # 秒数。0なら期限なし(環境変数GEMINI_CACHE_TTLで変更できる)
+# キーの版。保存済みの回答を使えなくする場合に上げる(古いキーの回答は使われずに古い順に消える)
+# 2: ストリーミングの回答が文字化けしたまま保存されていたため
+GEMINI_CACHE_VERSION = 2
+
+class GeminiCache:
+    """
+    Geminiの回答のキャッシュ(版とエンドポイントとモデル名とプロンプトのハッシュがキー)
+    エンドポイントを含めるので、テスト用のサーバー(gemini_stub)の回答が本物の回答として使われることはない
+    max_entriesを超えたら最後に使われたのが古いものから消す
+    """
+
+    def __init__(self, path=GEMINI_CACHE_PATH, max_entries=None, ttl=None):
+        self.path = f"{MODULE_PATH}/{path}"
+        self.max_entries = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", GEMINI_CACHE_MAX_ENTRIES)) if max_entries is None else max_entries
+        self.ttl = int(os.getenv("GEMINI_CACHE_TTL", GEMINI_CACHE_TTL)) if ttl is None else ttl
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+        """)
+
+    def connection(self):
+        """
+        スレッドごとのコネクション
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model, prompt, endpoint=None):
+        return hashlib.sha256(f"{GEMINI_CACHE_VERSION}\0{endpoint}\0{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def get(self, model, prompt, endpoint=None):
+        """
+        キャッシュされた回答(ない場合None。記録・再生時は常にNone)
+        """
+        from cassette import bypass_caches
+
+        if bypass_caches():
+            self.count("misses")
+            return None
+        key = self.key(model, prompt, endpoint)
+        conn = self.connection()
+        row = conn.execute("SELECT text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.count("misses")
+            return None
+        now = time.time()
+        if self.ttl > 0 and now - row[1] >= self.ttl:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.count("expired")
+            self.count("misses")
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.count("hits")
+        return row[0]
+
+    def put(self, model, prompt, text, endpoint=None):
+        """
+        回答を保存する(上限を超えた分は古いものから消す)
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, text, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.key(model, prompt, endpoint), model, text, now, now)
+            )
+            evicted = conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        if evicted > 0:
+            self.count("evicted", evicted)
+
+    def stats(self):
+        """
+        ヒット数などの統計(hit_rate: ヒット率)
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total > 0 else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+def get_gemini_cache():
+    """
+    プロセス内で共有するGeminiCacheを取得する
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GeminiCache()
+        return _cache
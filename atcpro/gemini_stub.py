@@ -0,0 +1,165 @@
+import argparse
+import sys
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+RESPONSE_PATH = "data/gemini.json"
+DEFAULT_TEXT = "テスト用の回答です。最近のコンテストではよく頑張っていますね。この調子で苦手な問題にも挑戦していきましょう。"
+
+def load_text(path=RESPONSE_PATH):
+    """
+    再生する回答(generateContentのレスポンス形式のJsonファイル。ない場合はDEFAULT_TEXT)
+    """
+    try:
+        with open(f"{MODULE_PATH}/{path}", encoding="utf-8") as f:
+            result = json.load(f)
+        return "".join(part["text"] for part in result["candidates"][0]["content"]["parts"])
+    except FileNotFoundError:
+        return DEFAULT_TEXT
+
+def response_json(text):
+    return {
+        "candidates": [
+            {
+                "content": {
+                    "parts": [{ "text": text }],
+                    "role": "model"
+                }
+            }
+        ]
+    }
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    """
+    Gemini APIの代わりに保存済みの回答を返す
+    - generateContent: 回答をまとめて返す
+    - streamGenerateContent?alt=sse: 回答をchunk_size文字ずつ、chunk_delay秒おきにserver-sent eventsで返す
+    """
+    text = DEFAULT_TEXT
+    first_token_delay = 0.5
+    chunk_delay = 0.05
+    chunk_size = 20
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        time.sleep(self.first_token_delay)
+
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for i in range(0, len(self.text), self.chunk_size):
+                    if i > 0:
+                        time.sleep(self.chunk_delay)
+                    event = f"data: {json.dumps(response_json(self.text[i:i + self.chunk_size]), ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+                    self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアントが途中で受信をやめた
+                pass
+        elif ":generateContent" in self.path:
+            # まとめて返す場合は全体が生成されるまで待つ
+            time.sleep(self.chunk_delay * (len(self.text) // self.chunk_size))
+            body = json.dumps(response_json(self.text), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+def start_stub_server(port=0, text=None, first_token_delay=0.5, chunk_delay=0.05, chunk_size=20):
+    """
+    テスト用のサーバーを別スレッドで起動する
+    return サーバー(server.server_address[1]がポート番号)
+    """
+    handler = type("Handler", (GeminiStubHandler,), {
+        "text": load_text() if text is None else text,
+        "first_token_delay": first_token_delay,
+        "chunk_delay": chunk_delay,
+        "chunk_size": chunk_size,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench(server):
+    """
+    まとめて受け取る場合とストリーミングの場合で、最初のテキストが届くまでの時間を比べる
+    """
+    from main import use_gemini, use_gemini_stream
+
+    os.environ["GEMINI_ENDPOINT"] = f"http://127.0.0.1:{server.server_address[1]}"
+    # キャッシュされないように毎回違うプロンプトにする
+    prompt = f"テスト {time.time()}"
+
+    start = time.perf_counter()
+    use_gemini(f"{prompt} (generateContent)")
+    blocking = time.perf_counter() - start
+
+    start = time.perf_counter()
+    first_token = None
+    for _chunk in use_gemini_stream(prompt):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    streaming = time.perf_counter() - start
+    print(f"generateContent: {blocking:.2f}s, streamGenerateContent: first token {first_token:.2f}s, total {streaming:.2f}s")
+
+def check(server, text):
+    """
+    ストリーミングで受け取った回答が返した回答(日本語)と一致するかを確認する
+    """
+    from main import use_gemini, use_gemini_stream
+
+    os.environ["GEMINI_ENDPOINT"] = f"http://127.0.0.1:{server.server_address[1]}"
+    prompt = f"テスト {time.time()}"
+    results = {
+        "generateContent": use_gemini(f"{prompt} (generateContent)"),
+        "streamGenerateContent": "".join(use_gemini_stream(prompt)),
+    }
+    ok = True
+    for name, result in results.items():
+        print(f"{name}: {'OK' if result == text else 'NG'} {result!r}")
+        ok = ok and result == text
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini APIのテスト用サーバー")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="最初のテキストを返すまでの秒数")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="テキストを返す間隔(秒)")
+    parser.add_argument("--chunk-size", type=int, default=20, help="一度に返す文字数")
+    parser.add_argument("--bench", action="store_true", help="最初のテキストが届くまでの時間を計測する")
+    parser.add_argument("--check", action="store_true", help="日本語の回答をストリーミングで正しく受け取れるかを確認する")
+    args = parser.parse_args()
+
+    if args.check:
+        text = "こんにちは、最近のコンテストではよく頑張っていますね。"
+        server = start_stub_server(args.port, text=text, first_token_delay=0, chunk_delay=0, chunk_size=3)
+        sys.exit(0 if check(server, text) else 1)
+
+    server = start_stub_server(args.port, first_token_delay=args.first_token_delay, chunk_delay=args.chunk_delay, chunk_size=args.chunk_size)
+    if args.bench:
+        bench(server)
+        return
+    print(f"GEMINI_ENDPOINT=http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,38 @@
-def get_problem_page(contest_id, problem_id):
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+FRONTIER_PATH = "data/crawl_frontier.sqlite3"
+ENDPOINT = "https://atcoder.jp"
+ABC175_START_EPOCH = 1597492800
+
+def get_problem_page(contest_id, problem_id, endpoint=ENDPOINT):
     """
     指定された問題のページを取得する関数  
     :param problem_id: 問題のID  
+    :param endpoint: 取得先(テスト用のサーバーを指定できる)  
     :return: 問題ページのHTML  
     """
     from main import get_html
-    import re
+    import html_parse
 
-    endpoint = "https://atcoder.jp"
-    
-    # 解説ページの取得
+    # 解説ページの取得(解説ページへのリンクのみパースする)
     url = f"{endpoint}/contests/{contest_id}/tasks/{problem_id}/editorial"
-    editorial_hub = get_html(url)
+    editorial_hub = get_html(url, parse_only=html_parse.editorial_links_only())
     if editorial_hub is None:
         raise ValueError(f"指定された問題のページが見つかりません: {contest_id} {problem_id}")
     
     # 解説ページIDを取得
-    editorial_a = editorial_hub.find_all("a")
-    for a in editorial_a:
-        href = a.get("href")
-        if href and re.search(r"editorial/\d+", href):
-            url = a.get("href")
-            break
-    # 解説ページを取得
+    editorial_a = editorial_hub.find("a")
+    if editorial_a is not None:
+        url = editorial_a.get("href")
+    # 解説ページを取得(本文のみパースする)
     url = f"{endpoint}/{url}"
-    editorial= get_html(url)
+    editorial= get_html(url, parse_only=html_parse.main_container_only())
     if editorial is None:
         raise ValueError(f"指定された問題の解説ページが見つかりません: {contest_id} {problem_id}")
     
@@ -49,35 +57,179 @@ def get_problem_page(contest_id, problem_id):
         "codes": editorial_codes
     }
 
-def save_problem_page():
+def get_search_problems(problem_json_ids):
     """
-    解説テキストとコードをJsonファイルに保存する
+    まだ保存されていないABC175以降の問題を古い順に返す  
+    (problem_id, contest_id, start_epoch)[]
     """
-    from main import get_detailed_problems_information, get_contests_information, get_json, set_json
+    from main import get_catalog
 
-    json_path = "data/problems_editorial.json"
-    problem_json = get_json(json_path)
-    problem_json_ids = set(problem_json.keys())
+    catalog = get_catalog()
+    start = catalog.problem_start()
+    # 保存されていないABC175以降の問題のみ取得
+    rows = [i for i in np.flatnonzero(start >= ABC175_START_EPOCH) if not catalog.problem_ids[i] in problem_json_ids]
+    # 若い順にソート
+    rows = sorted(rows, key=lambda i: start[i])
+    return [(catalog.problem_ids[i], catalog.contest_ids[catalog.problem_contest[i]], int(start[i])) for i in rows]
 
-    problems = get_detailed_problems_information()
-    problems_map = {problem["id"]: problem for problem in problems}
-    problem_ids = {problem["id"] for problem in problems}
-    
-    contests = get_contests_information()
-    contests = {contest["id"]: contest for contest in contests}
+def save_problem_page(batch_size=20):
+    """
+    解説テキストとコードを保存する  
+    batch_size件ごとに類似度インデックスへ追加する
+    """
+    from editorial_store import get_editorial_store
+    from similarity import update_index
 
-    # jsonに書き込まれていないもののみ取得
-    search_ids = problem_ids - problem_json_ids
-    # ABC175以降の問題のみを取得
-    search_ids = list(filter(lambda x: contests[problems_map[x]["contest_id"]]["start_epoch_second"] >= 1597492800, search_ids))
-    # 若い順にソート
-    search_ids = sorted(search_ids, key=lambda x: contests[problems_map[x]["contest_id"]]["start_epoch_second"])
+    store = get_editorial_store()
+    search_ids = get_search_problems(store.ids())
 
-    for i, id in enumerate(search_ids):
-        contest_id = problems_map[id]["contest_id"]
+    batch = {}
+    for i, (id, contest_id, _start_epoch) in enumerate(search_ids):
         data = get_problem_page(contest_id, id)
-        problem_json.update({ id: data })
-        set_json(json_path, problem_json)
+        store.put(id, data)
+        batch[id] = data
         print(f"contest: {contest_id}, problem: {id} success! {(i + 1) / len(search_ids): .1%} ({i + 1}/{len(search_ids)})")
 
-save_problem_page()
\ No newline at end of file
+        if len(batch) >= batch_size or i == len(search_ids) - 1:
+            update_index(batch)
+            batch = {}
+
+class CrawlFrontier:
+    """
+    クロール予定の問題(中断しても続きから再開できるように保存する)
+    status: pending(未取得), done(取得済み), failed(失敗)
+    """
+
+    def __init__(self, path=FRONTIER_PATH):
+        self.conn = sqlite3.connect(f"{MODULE_PATH}/{path}", isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                id TEXT PRIMARY KEY,
+                contest_id TEXT NOT NULL,
+                start_epoch INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+        """)
+
+    def add(self, problems):
+        """
+        (problem_id, contest_id, start_epoch)[] を追加する(追加済みのものは無視)
+        """
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO frontier (id, contest_id, start_epoch) VALUES (?, ?, ?)", problems)
+
+    def pending(self, max_attempts=3):
+        """
+        未取得(と再試行可能な失敗)の問題を古い順に返す
+        """
+        return self.conn.execute(
+            "SELECT id, contest_id, start_epoch FROM frontier WHERE status = 'pending' OR (status = 'failed' AND attempts < ?) ORDER BY start_epoch, id",
+            (max_attempts,)
+        ).fetchall()
+
+    def mark_done(self, problem_id):
+        self.conn.execute("UPDATE frontier SET status = 'done', attempts = attempts + 1, error = NULL WHERE id = ?", (problem_id,))
+
+    def mark_stored(self, problem_ids):
+        """
+        保存済みの問題をまとめて取得済みにする(保存後、取得済みにする前に中断した場合)
+        """
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("UPDATE frontier SET status = 'done', error = NULL WHERE id = ?", [(problem_id,) for problem_id in problem_ids])
+
+    def mark_failed(self, problem_id, error):
+        self.conn.execute("UPDATE frontier SET status = 'failed', attempts = attempts + 1, error = ? WHERE id = ?", (str(error), problem_id))
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM frontier GROUP BY status").fetchall())
+
+def crawl_problem_pages(workers=4, rate=1.0, batch_size=20, endpoint=ENDPOINT, refresh=False, max_attempts=3):
+    """
+    解説ページを並列で取得して保存する  
+    workers: 同時に取得する数, rate: endpointへの1秒あたりのリクエスト数の上限(全ワーカーで共有)  
+    refresh: 問題一覧を取得し直してクロール予定に追加する(Falseでも予定が空なら取得する)
+    """
+    from urllib.parse import urlsplit
+    from editorial_store import get_editorial_store
+    from similarity import update_index
+    from transport import get_transport
+
+    store = get_editorial_store()
+    frontier = CrawlFrontier()
+
+    def pending():
+        # 保存済みの問題は取得済みにして除く(予定に残ると空にならず、問題一覧を取得し直さなくなる)
+        problems = frontier.pending(max_attempts)
+        frontier.mark_stored([p[0] for p in problems if p[0] in store])
+        return [p for p in problems if not p[0] in store]
+
+    problems = pending()
+    if refresh or len(problems) == 0:
+        frontier.add(get_search_problems(store.ids()))
+        problems = pending()
+    if len(problems) == 0:
+        print("取得する問題はありません。")
+        return
+
+    get_transport().set_rate(urlsplit(endpoint).hostname, rate)
+    start = time.perf_counter()
+    completed = 0
+    batch = {}
+    queue = iter(problems)
+    in_flight = {}
+
+    def submit(executor):
+        for id, contest_id, _start_epoch in queue:
+            future = executor.submit(get_problem_page, contest_id, id, endpoint=endpoint)
+            in_flight[future] = (id, contest_id)
+            return True
+        return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers * 2):
+            if not submit(executor):
+                break
+        while in_flight:
+            done, _pending = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                id, contest_id = in_flight.pop(future)
+                completed += 1
+                try:
+                    data = future.result()
+                except Exception as e:
+                    frontier.mark_failed(id, e)
+                    print(f"contest: {contest_id}, problem: {id} failed: {e}")
+                else:
+                    store.put(id, data)
+                    frontier.mark_done(id)
+                    batch[id] = data
+
+                elapsed = time.perf_counter() - start
+                throughput = completed / elapsed
+                eta = (len(problems) - completed) / throughput if throughput > 0 else 0
+                print(f"contest: {contest_id}, problem: {id} {completed / len(problems): .1%} ({completed}/{len(problems)}) {throughput:.2f} problems/s, ETA {eta:.0f}s")
+
+                if len(batch) >= batch_size:
+                    update_index(batch)
+                    batch = {}
+                submit(executor)
+    if batch:
+        update_index(batch)
+    print(f"finished: {completed} problems in {time.perf_counter() - start:.1f}s, {frontier.counts()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="解説ページのクローラー")
+    parser.add_argument("--workers", type=int, default=4, help="同時に取得する数")
+    parser.add_argument("--rate", type=float, default=1.0, help="1秒あたりのリクエスト数の上限")
+    parser.add_argument("--batch-size", type=int, default=20, help="類似度インデックスに追加する単位")
+    parser.add_argument("--endpoint", default=ENDPOINT, help="取得先(テスト用のサーバーを指定できる)")
+    parser.add_argument("--refresh", action="store_true", help="問題一覧を取得し直す")
+    args = parser.parse_args()
+    crawl_problem_pages(workers=args.workers, rate=args.rate, batch_size=args.batch_size, endpoint=args.endpoint, refresh=args.refresh)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
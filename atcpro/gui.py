@@ -1,19 +1,43 @@
-import random
-import sys
-from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QScrollArea, QLineEdit, QTextEdit, QPushButton, QRadioButton, QLabel, QFrame, QProgressDialog, QErrorMessage, QMessageBox
-from PyQt6.QtGui import QDesktopServices, QCursor
-from PyQt6.QtCore import Qt, QUrl, pyqtSignal, QObject, QRunnable, QThreadPool
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.font_manager import FontProperties
-from main import get_histories, get_gemini_advice, get_recomend_problem, get_detailed_problems_information, get_difficulties
+import startup
+# 起動時のimport時間を記録する(sklearn, bs4などの重いモジュールは使うときか、ウィンドウ表示後に読み込む)
+with startup.ImportProfiler() as import_profiler:
+    import os
+    import random
+    import sys
+    import threading
+    from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QScrollArea, QLineEdit, QTextEdit, QPushButton, QRadioButton, QLabel, QFrame, QProgressDialog, QErrorMessage, QMessageBox
+    from PyQt6.QtGui import QDesktopServices, QCursor
+    from PyQt6.QtCore import Qt, QUrl, pyqtSignal, QObject, QRunnable, QThreadPool, QTimer
+    import matplotlib
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+    from matplotlib.figure import Figure
+    from main import search_pipeline, prefetch_persona_advices, get_catalog
+    from pipeline import PipelineCancelled
+    from session import get_session_cache
+startup.mark("imports")
 
 FONT_PATH = "C:/Windows/Fonts/BIZ-UDGOTHICR.TTC"
-font_prop = FontProperties(fname=FONT_PATH)
+# 起動時にモジュールを裏で読み込む(環境変数STARTUP_WARMUP=0で無効)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") != "0"
+# 起動時間の内訳を表示する(環境変数STARTUP_REPORT=1で有効)
+STARTUP_REPORT = os.getenv("STARTUP_REPORT", "0") != "0"
 
-plt.rcParams["font.family"] = font_prop.get_name()
-plt.rcParams["axes.unicode_minus"] = False
+matplotlib.rcParams["axes.unicode_minus"] = False
+
+_font_ready = False
+def setup_font():
+    """
+    グラフの日本語フォントを設定する(フォントファイルを開くので初めてグラフを描くときまで遅らせる)
+    """
+    global _font_ready
+    if _font_ready:
+        return
+    _font_ready = True
+    from matplotlib.font_manager import FontProperties
+    try:
+        matplotlib.rcParams["font.family"] = FontProperties(fname=FONT_PATH).get_name()
+    except (FileNotFoundError, RuntimeError) as err:
+        print(f"フォントを読み込めませんでした: {err}")
 
 USER_COLORS = {
     "gray": "#808080", 
@@ -37,6 +61,22 @@ COLOR_BORDERS = (
     ("red", -1)
 )
 
+AI_TYPES = ("祖母", "祖父", "母", "父", "姉", "兄", "妹", "弟")
+# 検索後に全員分のアドバイスを先に取得しておく(環境変数PREFETCH_ADVICES=0で無効)
+PREFETCH_ADVICES = os.getenv("PREFETCH_ADVICES", "1") != "0"
+# 常駐サービス(service.py)のURL。指定するとコンテスト履歴とおすすめ問題をサービスから取得する(環境変数ATCPRO_SERVICE)
+SERVICE_URL = os.getenv("ATCPRO_SERVICE")
+
+# 検索のステージと表示名
+SEARCH_STAGES = {
+    "histories": "コンテスト履歴",
+    "catalog": "問題・コンテスト情報",
+    "similarity_index": "類似度インデックス",
+    "submissions": "提出",
+    "recomends": "おすすめ問題",
+    "ai_text": "アドバイス",
+}
+
 def get_diff_color(diff) :
     """
     diffに対応した色コードを返す
@@ -53,23 +93,30 @@ class WorkerSignals(QObject):
     """
     finished = pyqtSignal(dict)
     error = pyqtSignal(str)
+    stage = pyqtSignal(str, object) # (ステージ名, 結果)
+    cancelled = pyqtSignal()
 
 class Worker(QRunnable):
     """
-    マルチスレッド実行用
+    マルチスレッド実行用  
+    stage_callback=Trueのとき、fnにステージの結果を通知する関数をon_stageとして渡す
     """
 
-    def __init__(self, fn, *args, **kwargs):
+    def __init__(self, fn, *args, stage_callback=False, **kwargs):
         super().__init__()
         self.fn = fn
         self.args = args 
         self.kwargs = kwargs
         self.signals = WorkerSignals()
+        if stage_callback:
+            self.kwargs["on_stage"] = self.signals.stage.emit
     
     def run(self):
         try:
             result = self.fn(*self.args, **self.kwargs)
             self.signals.finished.emit(result)
+        except PipelineCancelled:
+            self.signals.cancelled.emit()
         except Exception as e:
             self.signals.error.emit(str(e))
 
@@ -80,7 +127,17 @@ class ATCProWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.threadpool = QThreadPool()
+        self.search_id = 0
+        self.cancel_event = None
+        self.stage_results = {}
+        self.search_ai_type = None # 検索時に選択されていたai_type
+        self.ai_streaming_text = None # 受信中のアドバイス
+        self.session = None # 表示しているユーザーのUserSession
+        self.advice_context = None # アドバイスの作成に使う(user, コンテスト履歴, おすすめ問題)
+        self.progress_dialog = None
+        self.shown_cards = None # 表示中のおすすめ問題カードの(recomends, catalog)
         self.initGUI()
+        self.warm_up_catalog()
 
     def initGUI(self):
         self.setWindowTitle("atcpro")
@@ -135,8 +192,7 @@ class ATCProWindow(QWidget):
         
         # --- AIタイプラジオボタン
         ai_type_button_layout = QHBoxLayout()
-        ai_types = ("祖母", "祖父", "母", "父", "姉", "兄", "妹", "弟")
-        self.ai_type_buttons = [QRadioButton(ai_type, self) for ai_type in ai_types ]
+        self.ai_type_buttons = [QRadioButton(ai_type, self) for ai_type in AI_TYPES ]
         self.ai_type_buttons[0].setChecked(True)
         for ai_type_button in self.ai_type_buttons:
             ai_type_button.clicked.connect(self.on_change_ai_type)
@@ -187,57 +243,227 @@ class ATCProWindow(QWidget):
         self.setLayout(layout)
 
         
-    def fetch_atc_data(self):
+    def fetch_atc_data(self, user, ai_type, cancel, on_stage, previous=None):
         """
-        検索ボタンを押したときの処理(時間のかかる処理をここで実行)
+        検索ボタンを押したときの処理(時間のかかる処理をここで実行)  
+        ステージが終わるたびにon_stageで結果を通知する(ウィジェットには触らない)
         """
-        user = self.user_input.text()
-        ai_type = self.get_ai_type()
-        histories = get_histories(user)
-        recomends, difficulty = get_recomend_problem(user, histories=histories)
-        ai_text = get_gemini_advice(user, ai_type, histories=histories, recomend_problems=recomends, TEST=True)
-        if ai_text is None:
-            self.ai_text.setText("取得できませんでした！ごめんなさい！")
+        context = {}
+        def notify(name, result):
+            if name == "histories":
+                context["histories"] = result
+                # 後のステージで並べ替えられるのでコピーを渡す
+                result = list(result)
+            if name == "recomends":
+                # アドバイスの作成に使う情報(アドバイスのステージと同じ並び順の履歴)
+                on_stage("advice_context", (list(context["histories"]), result))
+            on_stage(name, result)
+
+        if SERVICE_URL:
+            from service import service_pipeline
+            pipeline = service_pipeline(SERVICE_URL, user, ai_type, on_ai_chunk=lambda chunk: on_stage("ai_chunk", chunk), cancel=cancel, previous=previous)
         else:
-            self.ai_text.setText(ai_text)
-            print(ai_text)
-
+            pipeline = search_pipeline(user, ai_type, on_ai_chunk=lambda chunk: on_stage("ai_chunk", chunk), cancel=cancel, previous=previous)
+        result = pipeline.run(on_stage=notify, cancel=cancel)
+        print(result.report())
         return {
-            "histories": histories[::-1],
-            "recomends": recomends,
-            "difficulty": difficulty,
-            "ai_text": ai_text
+            "histories": result["histories"][::-1],
+            "recomends": result["recomends"],
+            "catalog": result["catalog"],
+            "ai_text": result["ai_text"]
         }
 
     def on_search_click(self):
         """
-        検索ボタンを押したときの処理
+        検索ボタンを押したときの処理  
+        同じユーザーの結果があればすぐに表示し、TTLを過ぎていれば裏で取り直す
         """
-        self.progress_dialog = QProgressDialog("データを取得中...", "キャンセル", 0, 0, self)
-        self.progress_dialog.setModal(True)
-        self.progress_dialog.setWindowTitle("検索中")
-        self.progress_dialog.show()
+        # 前の検索(とアドバイスの先読み)が終わっていなければ中断する
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.close_progress_dialog()
+        self.search_id += 1
+        search_id = self.search_id
+        self.cancel_event = threading.Event()
+        self.stage_results = {}
+        self.search_ai_type = self.get_ai_type()
+        self.ai_streaming_text = None
+        self.advice_context = None
+
+        sessions = get_session_cache()
+        self.session = sessions.session(self.user_input.text())
+        if not self.session.is_complete():
+            self.start_search(search_id, show_progress=True)
+            return
+
+        self.show_session()
+        if sessions.is_stale(self.session):
+            # 表示は前回の結果のまま取り直す
+            self.start_search(search_id, show_progress=False)
+            return
+        # 足りないアドバイスだけ取得する
+        ai_types = [ai_type for ai_type in AI_TYPES if (PREFETCH_ADVICES or ai_type == self.search_ai_type) and not ai_type in self.session.advices]
+        if len(ai_types) > 0:
+            self.start_advice_worker(search_id, ai_types)
+
+    def start_search(self, search_id, show_progress):
+        """
+        検索のワーカーを起動する(show_progress=Falseのときはプログレスダイアログを出さない)
+        """
+        if show_progress:
+            self.progress_dialog = QProgressDialog("データを取得中...", "キャンセル", 0, len(SEARCH_STAGES), self)
+            self.progress_dialog.setWindowTitle("検索中")
+            self.progress_dialog.setMinimumDuration(0)
+            self.progress_dialog.canceled.connect(self.cancel_event.set)
+            self.progress_dialog.show()
+
+        worker = Worker(self.fetch_atc_data, self.session.user, self.search_ai_type, self.cancel_event, stage_callback=True, previous=self.session.previous())
+        worker.signals.stage.connect(lambda name, result: self.on_search_stage(search_id, name, result))
+        worker.signals.finished.connect(lambda result: self.on_search_finished(search_id, result))
+        worker.signals.error.connect(lambda error_message: self.on_search_error(search_id, error_message))
+        worker.signals.cancelled.connect(lambda: self.on_search_cancelled(search_id))
 
-        worker = Worker(self.fetch_atc_data)
-        worker.signals.finished.connect(self.on_search_finished)
-        worker.signals.error.connect(self.on_search_error)
+        self.threadpool.start(worker)
 
+    def show_session(self):
+        """
+        保存している検索結果を表示する
+        """
+        self.update_history_graph(histories=self.session.histories)
+        self.update_recomend_card(recomends=self.session.recomends, catalog=self.session.catalog)
+        self.advice_context = (self.session.user, *self.session.advice_context())
+        if self.search_ai_type in self.session.advices:
+            self.set_ai_text(self.session.advices[self.search_ai_type])
+        else:
+            self.ai_text.setText("...")
+
+    def on_search_stage(self, search_id, name, result):
+        """
+        ステージが終わったときの処理(終わったものから画面に反映する)
+        """
+        if search_id != self.search_id:
+            return
+        if name == "ai_chunk":
+            # 生成されたアドバイスを追記する
+            self.ai_streaming_text = (self.ai_streaming_text or "") + result
+            if self.get_ai_type() == self.search_ai_type:
+                self.ai_text.setText(self.ai_streaming_text)
+            return
+        if name == "advice_context":
+            self.start_prefetch_advices(search_id, *result)
+            return
+        if name == "advice":
+            ai_type, text = result
+            self.session.advices[ai_type] = text
+            if self.get_ai_type() == ai_type:
+                self.set_ai_text(text)
+            return
+        self.stage_results[name] = result
+        if self.progress_dialog is not None:
+            self.progress_dialog.setValue(len(self.stage_results))
+            self.progress_dialog.setLabelText(f"データを取得中... ({SEARCH_STAGES.get(name, name)}完了)")
+
+        # 取り直した結果が表示中のものと同じなら描き直さない
+        if name == "histories":
+            self.session.discard_advices_if_changed(result)
+            if not self.session.is_complete() or self.session.is_changed(result):
+                self.update_history_graph(histories=result)
+        if name == "recomends":
+            # おすすめ問題はカタログの後に終わるので、カタログを引くだけで表示できる
+            self.update_recomend_card(recomends=result, catalog=self.stage_results["catalog"])
+        if name == "ai_text":
+            self.session.advices[self.search_ai_type] = result
+            if self.get_ai_type() == self.search_ai_type:
+                self.set_ai_text(result)
+
+    def start_prefetch_advices(self, search_id, histories, recomends):
+        """
+        検索時に選択されていなかったai_typeのアドバイスのうち、まだないものを裏で取得する
+        """
+        self.advice_context = (self.session.user, histories, recomends)
+        if not PREFETCH_ADVICES:
+            return
+        ai_types = [ai_type for ai_type in AI_TYPES if ai_type != self.search_ai_type and not ai_type in self.session.advices]
+        if len(ai_types) > 0:
+            self.start_advice_worker(search_id, ai_types)
+
+    def start_advice_worker(self, search_id, ai_types):
+        """
+        ai_typesのアドバイスを取得するワーカーを起動する(結果はadviceステージとして通知する)
+        """
+        user, histories, recomends = self.advice_context
+        worker = Worker(self.fetch_advices, user, ai_types, histories, recomends, self.cancel_event, stage_callback=True)
+        worker.signals.stage.connect(lambda name, result: self.on_search_stage(search_id, name, result))
         self.threadpool.start(worker)
 
-    def on_search_finished(self, result):
+    @staticmethod
+    def fetch_advices(user, ai_types, histories, recomends, cancel, on_stage):
+        prefetch_persona_advices(
+            user, ai_types, histories, recomends,
+            on_advice=lambda ai_type, text: on_stage("advice", (ai_type, text)),
+            cancel=cancel
+        )
+        return {}
+
+    def on_search_finished(self, search_id, result):
         """
         ワーカースレッドの実行が終わった時の処理
         """
+        if search_id != self.search_id:
+            return
+        self.session.update(
+            histories=result["histories"],
+            recomends=result["recomends"],
+            catalog=result["catalog"]
+        )
+        self.close_progress_dialog()
+
+    def on_search_cancelled(self, search_id):
+        """
+        検索が中断されたときの処理
+        """
+        if search_id != self.search_id:
+            return
+        self.close_progress_dialog()
+
+    def warm_up_catalog(self):
+        """
+        問題・コンテスト情報を裏で読み込んでおく(get_catalogはプロセス内で保持するので、検索のcatalogステージが待たずに済む)
+        サービスを使う場合はサービス側で読み込むので何もしない
+        """
+        if SERVICE_URL:
+            return
+        worker = Worker(lambda: {"catalog": get_catalog()})
+        worker.signals.error.connect(lambda error_message: print(f"error: {error_message}"))
+        self.threadpool.start(worker)
+
+    def close_progress_dialog(self):
+        """
+        プログレスダイアログを閉じる(閉じるときのcanceledで検索を中断しないように切断してから閉じる)
+        """
+        if self.progress_dialog is None:
+            return
+        try:
+            self.progress_dialog.canceled.disconnect()
+        except TypeError:
+            pass
         self.progress_dialog.close()
-        self.update_history_graph(histories=result["histories"])
-        self.ai_text.setText(result["ai_text"])
-        self.update_recomend_card(recomends=result["recomends"], difficulty=result["difficulty"])
+        self.progress_dialog = None
+
+    def set_ai_text(self, ai_text):
+        if ai_text is None:
+            self.ai_text.setText("取得できませんでした！ごめんなさい！")
+        else:
+            self.ai_text.setText(ai_text)
+            print(ai_text)
 
-    def on_search_error(self, error_message):
+    def on_search_error(self, search_id, error_message):
         """
         ワーカースレッドでエラーが発生したときの処理
         """
-        self.progress_dialog.close()
+        if search_id != self.search_id:
+            return
+        self.close_progress_dialog()
         print(f"error: {error_message}")
 
         QMessageBox.critical(
@@ -249,9 +475,21 @@ class ATCProWindow(QWidget):
 
     def on_change_ai_type(self):
         """
-        ai_typeを変えた時の処理
+        ai_typeを変えた時の処理(取得済みのアドバイスがあればすぐに表示する)
         """
-        self.ai_text_title.setText(f"{self.get_ai_type()}のアドバイス")
+        ai_type = self.get_ai_type()
+        self.ai_text_title.setText(f"{ai_type}のアドバイス")
+        if self.session is None:
+            return
+        if ai_type in self.session.advices:
+            self.set_ai_text(self.session.advices[ai_type])
+        elif ai_type == self.search_ai_type and self.ai_streaming_text is not None:
+            self.ai_text.setText(self.ai_streaming_text)
+        else:
+            self.ai_text.setText("...")
+            # 先読みしない場合は選ばれたときに取得する
+            if not PREFETCH_ADVICES and ai_type != self.search_ai_type and self.advice_context is not None:
+                self.start_advice_worker(self.search_id, [ai_type])
 
     def get_ai_type(self):
         """
@@ -266,6 +504,8 @@ class ATCProWindow(QWidget):
         """
         グラフを書き換える
         """
+        # サンプルのグラフにも日本語の軸ラベルがあるので、履歴がなくてもフォントを設定する
+        setup_font()
         self.history_ax.clear()
 
         self.history_ax.axhspan(0, 400, facecolor=USER_COLORS["gray"], alpha=0.3)
@@ -278,7 +518,8 @@ class ATCProWindow(QWidget):
         self.history_ax.axhspan(2800, 4000, facecolor=USER_COLORS["red"], alpha=0.3)
 
         if not histories is None:
-            histories.reverse()
+            # 渡されたリストはセッションが保持しているので並べ替えない(古い順のコピーを使う)
+            histories = histories[::-1]
             x = [history["contest_id"] for history in histories]
             y = [history["rating"] for history in histories]
             self.history_fig.autofmt_xdate()
@@ -307,42 +548,29 @@ class ATCProWindow(QWidget):
         self.history_fig.tight_layout()
         self.history_graph.draw()
     
-    def update_recomend_card(self, recomends=None, difficulty=None):
+    def update_recomend_card(self, recomends=None, catalog=None):
         """
-        おすすめ問題を書き換える
+        おすすめ問題を書き換える(UIスレッドで呼ぶので通信はせず、catalogを引くだけにする)
         """
         if recomends is None:
             card = LinkCard(title="Sample", name="sample", diff=0, url="")
             self.links_scroll_layout.addWidget(card)
             return 
+        # 表示中のものと同じなら描き直さない
+        if self.shown_cards is not None and self.shown_cards[0] is recomends and self.shown_cards[1] is catalog:
+            return
+        self.shown_cards = (recomends, catalog)
 
         while self.links_scroll_layout.count():
             child = self.links_scroll_layout.takeAt(0)
             if child.widget():
                 child.widget().deleteLater()
-        
-        if difficulty is None:
-            difficulty = get_difficulties()
-        problems_detail = get_detailed_problems_information()
-        problems_detail = {p["id"]: p for p in problems_detail}
-        problems = [problems_detail[r[0]] for r in recomends if r[0] in problems_detail]
-        
-        for problem in problems:
-            problem_id = problem["id"]
-            if not problem_id in difficulty:
-                diff = 0
-            else :
-                diff = difficulty[problem_id]["difficulty"]
-            if not problem_id in problems_detail:
-                url = ""
-            else :
-                detail = problems_detail[problem_id]
-                if not "contest_id" in detail:
-                    url = ""
-                else :
-                    url = f"https://atcoder.jp/contests/{detail['contest_id']}/tasks/{problem_id}"
-            
-            card = LinkCard(problem_id, problem['name'], diff, url)
+
+        for recomend in recomends:
+            info = catalog.card(recomend[0])
+            if info is None:
+                continue
+            card = LinkCard(*info)
             card.clicked.connect(self.open_url_in_browser)
             self.links_scroll_layout.addWidget(card, 1)
 
@@ -405,10 +633,27 @@ class LinkCard(QFrame):
         super().mousePressEvent(event)
 
 
+def on_window_shown():
+    """
+    イベントループが始まった(ウィンドウが表示された)ときの処理
+    """
+    startup.mark("window_shown")
+    timings, thread = startup.warm_up() if STARTUP_WARMUP else (None, None)
+    if STARTUP_REPORT:
+        def print_report():
+            # 裏での読み込み時間も出すので、読み込みが終わるのを(イベントループを止めずに)待つ
+            if thread is not None:
+                thread.join()
+            print(startup.report(import_profiler, timings))
+        threading.Thread(target=print_report, daemon=True).start()
+
 def windowShow():
     qAp = QApplication(sys.argv)
+    startup.mark("qapplication")
     atcw = ATCProWindow()
+    startup.mark("window_created")
     atcw.show()
+    QTimer.singleShot(0, on_window_shown)
     qAp.exec()
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+HISTORY_DB_PATH = "data/histories.sqlite3"
+HISTORY_KEYS = ("date", "contest_id", "rank", "pafs", "rating", "diff") # get_historiesが返す順
+HISTORY_TTL = 600 # 秒数。最後の同期からこの時間は取得し直さない(環境変数HISTORY_TTLで変更できる)
+HISTORY_SOURCE = "json" # 取得元 json | html(環境変数HISTORY_SOURCEで変更できる)
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+def fetch_histories_json(user):
+    """
+    JSONのAPIからレート変動のあったコンテスト履歴を取得する(新しい順、失敗した場合None)
+    """
+    from main import get_api
+
+    results = get_api(f"https://atcoder.jp/users/{user}/history/json")
+    if results is None:
+        return None
+    ret = []
+    for result in results[::-1]:
+        if not result["IsRated"]:
+            continue
+        # HTMLの表のdata-orderと同じ形式(日本時間)にする
+        date = datetime.datetime.fromisoformat(result["EndTime"]).astimezone(JST).strftime("%Y/%m/%d %H:%M:%S")
+        ret.append({
+            "date": date,
+            "contest_id": result["ContestScreenName"].split(".")[0],
+            "rank": str(result["Place"]),
+            "pafs": str(result["Performance"]),
+            "rating": result["NewRating"],
+            "diff": result["NewRating"] - result["OldRating"],
+        })
+    return ret
+
+def fetch_histories_html(user):
+    """
+    HTMLの表からレート変動のあったコンテスト履歴を取得する(新しい順、失敗した場合None)
+    """
+    from main import get_html, parse_histories
+    import html_parse
+
+    soup = get_html(f"https://atcoder.jp/users/{user}/history?contestType=algo", parse_only=html_parse.history_rows_only())
+    if soup is None:
+        return None
+    return parse_histories(soup, N=None)
+
+HISTORY_SOURCES = {
+    "json": fetch_histories_json,
+    "html": fetch_histories_html,
+}
+
+def sort_oldest_first(histories):
+    """
+    コンテスト履歴を古い順に並べ替える(その場で)
+    dateはゼロ埋めの "%Y/%m/%d %H:%M:%S"(日本時間)なので、文字列の順がそのまま日時の順になる
+    """
+    histories.sort(key=lambda x: x["date"])
+
+def date2epoch(date):
+    return int(datetime.datetime.strptime(date, "%Y/%m/%d %H:%M:%S").replace(tzinfo=JST).timestamp())
+
+class HistoryStore:
+    """
+    ユーザーのコンテスト履歴をローカルに保存する(SQLite)
+    取得元から取得した履歴のうち、保存済みの最後のコンテストより新しいものだけを追加する
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH, ttl=None, source=None):
+        self.path = f"{MODULE_PATH}/{path}"
+        self.ttl = int(os.getenv("HISTORY_TTL", HISTORY_TTL)) if ttl is None else ttl
+        self.source = os.getenv("HISTORY_SOURCE", HISTORY_SOURCE) if source is None else source
+        if not self.source in HISTORY_SOURCES:
+            raise ValueError(f"未定義の取得元です: {self.source}")
+        self.local = threading.local()
+        self.sync_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self.connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS histories (
+                user_id TEXT NOT NULL,
+                contest_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                epoch_second INTEGER NOT NULL,
+                rank TEXT,
+                pafs TEXT,
+                rating INTEGER,
+                diff INTEGER,
+                PRIMARY KEY (user_id, contest_id)
+            );
+            CREATE INDEX IF NOT EXISTS histories_user_epoch ON histories (user_id, epoch_second);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                user_id TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL -- 最後に同期した時刻
+            );
+        """)
+
+    def connection(self):
+        """
+        スレッドごとのコネクション
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def synced_at(self, user):
+        row = self.connection().execute("SELECT synced_at FROM sync_state WHERE user_id = ?", (user,)).fetchone()
+        return None if row is None else row["synced_at"]
+
+    def merge(self, user, histories):
+        """
+        保存済みの最後のコンテストより新しい履歴を追加する
+        return 追加した件数
+        """
+        conn = self.connection()
+        last = conn.execute("SELECT MAX(epoch_second) FROM histories WHERE user_id = ?", (user,)).fetchone()[0]
+        rows = []
+        for history in histories:
+            epoch_second = date2epoch(history["date"])
+            if last is not None and epoch_second <= last:
+                continue
+            rows.append((user, history["contest_id"], history["date"], epoch_second, history["rank"], history["pafs"], history["rating"], history["diff"]))
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO histories (user_id, contest_id, date, epoch_second, rank, pafs, rating, diff) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute("INSERT OR REPLACE INTO sync_state (user_id, synced_at) VALUES (?, ?)", (user, time.time()))
+        return len(rows)
+
+    def sync(self, user, force=False, cancel=None):
+        """
+        最後の同期からttl秒以上経っていれば取得元から取得して追加する
+        cancel: threading.Event。セットされていれば取得せずにPipelineCancelledを投げる
+        return 追加した件数
+        """
+        from cassette import bypass_caches
+        from pipeline import check_cancelled
+
+        force = force or bypass_caches()
+        with self.sync_lock:
+            synced_at = self.synced_at(user)
+            if not force and synced_at is not None and time.time() - synced_at < self.ttl:
+                return 0
+            check_cancelled(cancel)
+            histories = HISTORY_SOURCES[self.source](user)
+            if histories is None:
+                # 取得に失敗した場合は保存済みのものを使う
+                return 0
+            return self.merge(user, histories)
+
+    def latest(self, user, N=10, since=None, until=None):
+        """
+        直近N件のコンテスト履歴(新しい順)。Nが None なら全件
+        since, until: この期間(エポック秒、両端を含む)のもののみ
+        """
+        query = "SELECT * FROM histories WHERE user_id = ?"
+        params = [user]
+        if since is not None:
+            query += " AND epoch_second >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND epoch_second <= ?"
+            params.append(until)
+        query += " ORDER BY epoch_second DESC"
+        if N is not None:
+            query += " LIMIT ?"
+            params.append(N)
+        rows = self.connection().execute(query, params)
+        return [{key: row[key] for key in HISTORY_KEYS} for row in rows]
+
+_store = None
+_store_lock = threading.Lock()
+def get_history_store():
+    """
+    プロセス内で共有するHistoryStoreを取得する
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
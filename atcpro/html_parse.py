@@ -0,0 +1,120 @@
+import argparse
+import os
+import re
+import time
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+EDITORIAL_LINK_PATTERN = re.compile(r"editorial/\d+")
+
+_parser = None
+def get_parser():
+    """
+    使用するパーサー(lxmlがあればlxml、なければhtml.parser)
+    """
+    global _parser
+    if _parser is None:
+        try:
+            import lxml # 入っているかの確認のみ
+            _parser = "lxml"
+        except ImportError:
+            _parser = "html.parser"
+    return _parser
+
+def parse(html, parse_only=None, parser=None):
+    """
+    HTMLをパースする
+    parse_only: SoupStrainer。一致する要素(とその子孫)のみを木にする
+    """
+    from bs4 import BeautifulSoup # 起動を速くするため使うときに読み込む
+
+    return BeautifulSoup(html, parser or get_parser(), parse_only=parse_only)
+
+def history_rows_only():
+    """
+    コンテスト履歴の表の行のみ
+    """
+    from bs4 import SoupStrainer
+
+    return SoupStrainer("tr")
+
+def editorial_links_only():
+    """
+    解説ページへのリンクのみ
+    """
+    from bs4 import SoupStrainer
+
+    return SoupStrainer("a", href=EDITORIAL_LINK_PATTERN)
+
+def main_container_only():
+    """
+    本文(#main-container)のみ
+    """
+    from bs4 import SoupStrainer
+
+    return SoupStrainer("div", id="main-container")
+
+def bench_history(html):
+    """
+    コンテスト履歴のページ: html.parserで全体をパース vs 表の行のみをパース
+    """
+    from main import parse_histories
+
+    def full():
+        return parse_histories(parse(html, parser="html.parser"), N=10**9)
+    def targeted():
+        return parse_histories(parse(html, history_rows_only()), N=10**9)
+    return full, targeted
+
+def bench_editorial(html):
+    """
+    解説ページ: html.parserで全体をパース vs リンクと本文のみをパース
+    """
+    def full():
+        soup = parse(html, parser="html.parser")
+        links = [a.get("href") for a in soup.find_all("a") if a.get("href") and EDITORIAL_LINK_PATTERN.search(a.get("href"))]
+        container = soup.find("div", id="main-container")
+        return links, None if container is None else container.text.strip()
+    def targeted():
+        links = [a.get("href") for a in parse(html, editorial_links_only()).find_all("a")]
+        container = parse(html, main_container_only()).find("div", id="main-container")
+        return links, None if container is None else container.text.strip()
+    return full, targeted
+
+def bench(path, kind, repeat=20):
+    """
+    保存したHTMLでパース時間を比べる(結果が一致するかも確認する)
+    """
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    full, targeted = (bench_history if kind == "history" else bench_editorial)(html)
+    timings = {}
+    results = {}
+    for name, fn in (("full", full), ("targeted", targeted)):
+        results[name] = fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        timings[name] = (time.perf_counter() - start) / repeat
+    print(
+        f"{os.path.basename(path)} ({kind}, {len(html)} chars): "
+        f"html.parser {timings['full'] * 1000:.1f}ms/page, {get_parser()}+strainer {timings['targeted'] * 1000:.1f}ms/page "
+        f"(x{timings['full'] / timings['targeted']:.1f}), same result: {results['full'] == results['targeted']}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="保存したHTMLでパース時間を計測する")
+    parser.add_argument("--history", nargs="*", default=["data/history.html"], help="コンテスト履歴のページ")
+    parser.add_argument("--editorial", nargs="*", default=[], help="解説ページ")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for kind, paths in (("history", args.history), ("editorial", args.editorial)):
+        for path in paths:
+            path = path if os.path.isabs(path) else f"{MODULE_PATH}/{path}"
+            if not os.path.exists(path):
+                print(f"ファイルがありません: {path}")
+                continue
+            bench(path, kind, repeat=args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+from cassette import bypass_caches
+from transport import get_transport
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+HTTP_CACHE_DIR = "data/http_cache"
+HTTP_CACHE_TTL = 3600 # 再検証するまでの秒数(環境変数HTTP_CACHE_TTLで変更できる)
+
+class HttpCache:
+    """
+    URLごとにレスポンス(JSON)を保存するキャッシュ
+    - 本文はgzipで圧縮して保存する
+    - TTLを過ぎたらETag/Last-Modifiedを使って条件付きリクエストで再検証する
+    """
+
+    def __init__(self, path=HTTP_CACHE_DIR, ttl=None):
+        self.path = f"{MODULE_PATH}/{path}"
+        self.ttl = int(os.getenv("HTTP_CACHE_TTL", HTTP_CACHE_TTL)) if ttl is None else ttl
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # 読み込み済みのJSON(同じプロセスで何度もパースしないように保持する)
+        self.memory = {}
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0}
+
+    @staticmethod
+    def key(url, params=None):
+        if params:
+            url = f"{url}?{urlencode(sorted(params.items()))}"
+        return url, hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def read_meta(self, key):
+        try:
+            with open(f"{self.path}/{key}.json", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def read_body(self, key, meta):
+        """
+        保存済みの本文をJSONとして読み込む(壊れている場合はValueError/OSError)
+        """
+        memory = self.memory.get(key)
+        if memory is not None and memory[0] == meta["stored_at"]:
+            return memory[1]
+        with gzip.open(f"{self.path}/{key}.gz", "rb") as f:
+            data = json.loads(f.read())
+        self.memory[key] = (meta["stored_at"], data)
+        return data
+
+    def write(self, key, url, res):
+        """
+        レスポンスを保存する(本文 -> メタ情報の順に置き換える)
+        """
+        stored_at = time.time()
+        with gzip.open(f"{self.path}/{key}.gz.tmp", "wb") as f:
+            f.write(res.content)
+        os.replace(f"{self.path}/{key}.gz.tmp", f"{self.path}/{key}.gz")
+        meta = {
+            "url": url,
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "stored_at": stored_at,
+            "checked_at": stored_at,
+        }
+        self.write_meta(key, meta)
+        return meta
+
+    def write_meta(self, key, meta):
+        with open(f"{self.path}/{key}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{self.path}/{key}.json.tmp", f"{self.path}/{key}.json")
+
+    def invalidate(self, key):
+        """
+        保存済みのレスポンスを消す(次のfetchで取得し直す)
+        """
+        with self.key_lock(key):
+            self.memory.pop(key, None)
+            for name in (f"{key}.json", f"{key}.gz"):
+                try:
+                    os.remove(f"{self.path}/{name}")
+                except FileNotFoundError:
+                    pass
+
+    def fetch(self, url, params=None, ttl=None):
+        """
+        保存済みのレスポンスを必要なら再検証・取得して最新にする
+        本文がJSONとして読めないレスポンス(メンテナンス中のHTMLなど)は保存しない
+        return (key, メタ情報, 新しく取得した場合はパースしたJSON)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        full_url, key = self.key(url, params)
+        with self.key_lock(key):
+            meta = self.read_meta(key)
+            # 記録・再生時は保存済みのものに関わらず取得する(cassette.bypass_cachesを参照)
+            bypass = bypass_caches()
+            if not bypass and meta is not None and time.time() - meta["checked_at"] < ttl:
+                self.count("hits")
+                return key, meta, None
+
+            headers = {}
+            if not bypass and meta is not None:
+                if meta["etag"]:
+                    headers["If-None-Match"] = meta["etag"]
+                if meta["last_modified"]:
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            try:
+                res = get_transport().get(url, params=params, headers=headers)
+                if res.status_code == 304 and meta is not None:
+                    self.count("revalidated")
+                    meta["checked_at"] = time.time()
+                    self.write_meta(key, meta)
+                    return key, meta, None
+                res.raise_for_status()
+                data = res.json() # JSONでなければrequests.exceptions.JSONDecodeError
+            except Exception:
+                # 通信できない場合は古いキャッシュを返す
+                if meta is None:
+                    raise
+                self.count("stale")
+                return key, meta, None
+
+            self.count("misses")
+            meta = self.write(key, full_url, res)
+            self.memory[key] = (meta["stored_at"], data)
+            return key, meta, data
+
+    def get_json(self, url, params=None, ttl=None):
+        """
+        urlのJSONを取得する(キャッシュが新しければ通信しない)
+        返り値はプロセス内で共有されるので変更しないこと
+        """
+        key, meta, data = self.fetch(url, params, ttl)
+        if data is not None:
+            return data
+        try:
+            return self.read_body(key, meta)
+        except (OSError, EOFError, ValueError):
+            # 保存済みの本文が壊れている場合はキャッシュにないものとして取得し直す
+            self.invalidate(key)
+            _key, meta, data = self.fetch(url, params, ttl)
+            return data if data is not None else self.read_body(key, meta)
+
+    def version(self, url, params=None, ttl=None):
+        """
+        urlのレスポンスの版(保存した時刻)。本文は読み込まないので、更新されたかの確認に使う
+        """
+        _key, meta, _res = self.fetch(url, params, ttl)
+        return meta["stored_at"]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+_cache = None
+_cache_lock = threading.Lock()
+def get_http_cache():
+    """
+    プロセス内で共有するHttpCacheを取得する
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache()
+        return _cache
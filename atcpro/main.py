@@ -2,34 +2,61 @@
 import datetime
 import json
 import os
-import time
-import re
-from bs4 import BeautifulSoup
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
+from catalog import Catalog, join_submissions
+from editorial_store import get_editorial_store
+from gemini_cache import get_gemini_cache
+import html_parse
+from history_store import HISTORY_KEYS, get_history_store, sort_oldest_first
+from http_cache import get_http_cache
+from pipeline import Pipeline, check_cancelled
+from similarity import DIFFICULTY_MISSING, DIFFICULTY_NONE, get_similarity_index, top_n
+from session import histories_key
+from submission_store import get_submission_store
+from transport import get_transport
 from dotenv import load_dotenv
 load_dotenv()
 
-# TEST = False
-
-def get_api(url, params=None, TEST=False):
-    if TEST:
-        return None
+def get_api(url, params=None):
     try:
-        time.sleep(1)
-        res = requests.get(url, params=params)
+        res = get_transport().get(url, params=params)
         res.raise_for_status()
         data = res.json()
         return data
     except requests.exceptions.RequestException as err:
-        print(f"Error: {err}")
+        print(f"Error: {err}", file=sys.stderr)
 
-def use_gemini(prompt, TEST=False):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={os.getenv('GEMINI_API_KEY')}"
-    headers = {
-        "Content-Type": "applicatoin/json"
-    }
+def get_cached_api(url, params=None):
+    """
+    ディスクキャッシュを使って取得する(サイズの大きいデータ用)
+    返り値は共有されるので変更しないこと
+    """
+    try:
+        return get_http_cache().get_json(url, params)
+    except requests.exceptions.RequestException as err:
+        print(f"Error: {err}", file=sys.stderr)
+
+GEMINI_ENDPOINT = "https://generativelanguage.googleapis.com"
+GEMINI_MODEL = "gemini-2.0-flash"
+
+def gemini_endpoint():
+    """
+    GeminiのAPIのエンドポイント(環境変数GEMINI_ENDPOINTでテスト用のサーバーを指定できる)
+    """
+    return os.getenv("GEMINI_ENDPOINT", GEMINI_ENDPOINT)
+
+def gemini_url(method):
+    """
+    GeminiのAPIのURL
+    """
+    endpoint = gemini_endpoint()
+    return f"{endpoint}/v1beta/models/{GEMINI_MODEL}:{method}?key={os.getenv('GEMINI_API_KEY')}"
+
+def gemini_request_body(prompt):
     prompt =  f"""
             マークダウン記法を使わずに、プレーンテキストで回答してください。
             箇条書きは使わず、通常の文章で記述してください。
@@ -49,38 +76,89 @@ def use_gemini(prompt, TEST=False):
             }
         ]
     }
+    return json.dumps(data)
 
+def gemini_text(result):
+    """
+    Geminiのレスポンスから生成されたテキストを取り出す(ない場合None)
+    """
+    if "candidates" in result and len(result["candidates"]) > 0:
+        parts = result["candidates"][0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+    print("テキストを生成できませんでした。", file=sys.stderr)
+    if "promptFeedback" in result:
+        print(f"プロンプトフィードバック: {result['promptFeedback']}", file=sys.stderr)
+
+def use_gemini(prompt):
+    """
+    同じプロンプトの回答がキャッシュにあれば通信せずに返す
+    """
+    headers = {
+        "Content-Type": "application/json"
+    }
+    body = gemini_request_body(prompt)
+    cache = get_gemini_cache()
+    text = cache.get(GEMINI_MODEL, body, endpoint=gemini_endpoint())
+    if text is not None:
+        return text
     try:
-        if TEST:
-            response = get_json("data/gemini.json")
-            result = response
-        else:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
-            response.raise_for_status()
-            result = response.json()
-
-        if "candidates" in result and len(result["candidates"]) > 0:
-            generated_text = result["candidates"][0]["content"]["parts"][0]["text"]
-            return generated_text
-        else:
-            print("テキストを生成できませんでした。")
-            if "promptFeedback" in result:
-                print(f"プロンプトフィードバック: {result['promptFeedback']}")
+        response = get_transport().post(gemini_url("generateContent"), headers=headers, data=body)
+        response.raise_for_status()
+        text = gemini_text(response.json())
+        if text is not None:
+            cache.put(GEMINI_MODEL, body, text, endpoint=gemini_endpoint())
+        return text
     except requests.exceptions.RequestException as e:
-        print(f"APIリクエスト中にエラーが発生しました: {e}")
+        print(f"APIリクエスト中にエラーが発生しました: {e}", file=sys.stderr)
     except json.JSONDecodeError:
-        print(f"JSONでコードエラー: {response.text}")
+        print(f"JSONでコードエラー: {response.text}", file=sys.stderr)
 
-def get_html(url, TEST=False):
-    if TEST:
-        return None
+def use_gemini_stream(prompt):
+    """
+    Geminiの回答を生成されたものから順に返すジェネレーター(server-sent events)
+    同じプロンプトの回答がキャッシュにあれば通信せずにまとめて返す
+    """
+    headers = {
+        "Content-Type": "application/json"
+    }
+    body = gemini_request_body(prompt)
+    cache = get_gemini_cache()
+    text = cache.get(GEMINI_MODEL, body, endpoint=gemini_endpoint())
+    if text is not None:
+        yield text
+        return
     try:
-        time.sleep(1)
-        res = requests.get(url)
-        soup = BeautifulSoup(res.text, 'html.parser')
+        response = get_transport().post(f"{gemini_url('streamGenerateContent')}&alt=sse", headers=headers, data=body, stream=True)
+        response.raise_for_status()
+        chunks = []
+        with response:
+            # server-sent eventsはUTF-8(charsetがないとrequestsはISO-8859-1で読むのでバイト列で受け取る)
+            for line in response.iter_lines():
+                line = line.decode("utf-8")
+                if not line or not line.startswith("data:"):
+                    continue
+                text = gemini_text(json.loads(line[len("data:"):]))
+                if text:
+                    chunks.append(text)
+                    yield text
+        # 最後まで受け取れた場合のみ保存する
+        if chunks:
+            cache.put(GEMINI_MODEL, body, "".join(chunks), endpoint=gemini_endpoint())
+    except requests.exceptions.RequestException as e:
+        print(f"APIリクエスト中にエラーが発生しました: {e}", file=sys.stderr)
+    except json.JSONDecodeError as e:
+        print(f"JSONでコードエラー: {e}", file=sys.stderr)
+
+def get_html(url, parse_only=None):
+    """
+    parse_only: SoupStrainer。一致する部分のみをパースする(html_parseを参照)
+    """
+    try:
+        res = get_transport().get(url)
+        soup = html_parse.parse(res.text, parse_only)
         return soup
     except requests.exceptions.RequestException as err:
-        print(f"Error: {err}")
+        print(f"Error: {err}", file=sys.stderr)
 
 def get_text(path):
     module_path = os.path.abspath(os.path.dirname(__file__))
@@ -97,21 +175,21 @@ def set_json(path, data):
     with open(f"{module_path}/{path}", "w",encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
-def get_contests_information(TEST=False):
-    if TEST:
-        return get_json("./data/contests.json")
-    return get_api("https://kenkoooo.com/atcoder/resources/contests.json")
+CONTESTS_URL = "https://kenkoooo.com/atcoder/resources/contests.json"
+MERGED_PROBLEMS_URL = "https://kenkoooo.com/atcoder/resources/merged-problems.json"
+PROBLEM_MODELS_URL = "https://kenkoooo.com/atcoder/resources/problem-models.json"
+
+def get_contests_information():
+    return get_cached_api(CONTESTS_URL)
 
 def get_problems_information():
-    return get_api("https://kenkoooo.com/atcoder/resources/problems.json")
+    return get_cached_api("https://kenkoooo.com/atcoder/resources/problems.json")
 
-def get_detailed_problems_information(TEST=False):
-    if TEST: 
-        return get_json("./data/merged-problems.json")
-    return get_api("https://kenkoooo.com/atcoder/resources/merged-problems.json")
+def get_detailed_problems_information():
+    return get_cached_api(MERGED_PROBLEMS_URL)
 
 def get_pairs_of_contests_and_problems():
-    return get_api("https://kenkoooo.com/atcoder/resources/contest-problem.json")
+    return get_cached_api("https://kenkoooo.com/atcoder/resources/contest-problem.json")
 
 def get_accepted_count(user):
     params = {"user": user}
@@ -125,9 +203,7 @@ def get_accepted_count_for_each_language(user):
     params = {"user": user}
     return get_api("https://kenkoooo.com/atcoder/atcoder-api/v3/user/language_rank", params)
 
-def get_user_submissions(user, from_second, TEST=False):
-    if TEST:
-        return get_json("./data/submissions.json")
+def get_user_submissions(user, from_second):
     params = {"user": user, "from_second": from_second}
     return get_api("https://kenkoooo.com/atcoder/atcoder-api/v3/user/submissions", params)
 
@@ -146,21 +222,24 @@ def get_difficulties():
     """
     問題の難易度
     """
-    return get_api("https://kenkoooo.com/atcoder/resources/problem-models.json")
+    return get_cached_api(PROBLEM_MODELS_URL)
 
-USER_HISTORY_KEY = ("date", "contest_id", "rank", "pafs", "rating", "diff")
-def get_histories(user, N=10, TEST=False):
+USER_HISTORY_KEY = HISTORY_KEYS
+def get_histories(user, N=10, since=None, until=None, cancel=None):
     """
-    直近の10コンテストの情報を取得  
-    Args: user(str): userID  
-    Returns: { date, contest_id, rank, pafs, rating, diff }[]
+    直近のN(Noneなら全)コンテストの情報を取得  
+    保存済みの履歴から返す(最後の同期から時間が経っていれば新しいコンテストのみ追加する)  
+    Args: user(str): userID, since/until(int): この期間(エポック秒)のもののみ, cancel(threading.Event): セットされたら取得を中断する  
+    Returns: { date, contest_id, rank, pafs, rating, diff }[] (新しい順)
     """
+    store = get_history_store()
+    store.sync(user, cancel=cancel)
+    return store.latest(user, N=N, since=since, until=until)
 
-    if TEST:
-        html = get_text("./data/history.html")
-        soup = BeautifulSoup(html, 'html.parser')
-    else:
-        soup = get_html(f"https://atcoder.jp/users/{user}/history?contestType=algo")
+def parse_histories(soup, N=10):
+    """
+    コンテスト履歴のページから直近N(Noneなら全)件を取り出す
+    """
     trs = soup.find_all("tr")
     ret = []
     for tr in trs[::-1]:
@@ -187,101 +266,142 @@ def get_histories(user, N=10, TEST=False):
                     infos[key] = int(td.text.strip())
         if will_append:                
             ret.append(infos)
-            if len(ret) >= N:
+            if N is not None and len(ret) >= N:
                 break
     return ret
 
-def get_submissions_merge_contest_info(user, histories=None):
+_catalog = None
+_catalog_lock = threading.Lock()
+def get_catalog(refresh=False, cancel=None):
+    """
+    問題・コンテスト・難易度のカタログ  
+    元データ(HTTPキャッシュ)が更新されていなければJSONを読み込まずにスナップショットを使う  
+    refresh: スナップショットを作り直す  
+    cancel: threading.Event。セットされたら元データの取得の合間にPipelineCancelledを投げる
+    """
+    global _catalog
+    with _catalog_lock:
+        cache = get_http_cache()
+        sources = {}
+        for url in (CONTESTS_URL, MERGED_PROBLEMS_URL, PROBLEM_MODELS_URL):
+            check_cancelled(cancel)
+            sources[url] = cache.version(url)
+        if not refresh and _catalog is not None and _catalog.sources == sources:
+            return _catalog
+        if not refresh and Catalog.exists():
+            catalog = Catalog.load()
+            if catalog.sources == sources:
+                _catalog = catalog
+                return _catalog
+        raw = (get_contests_information(), get_detailed_problems_information(), get_difficulties())
+        if any(data is None for data in raw):
+            raise RuntimeError("問題・コンテスト情報を取得できませんでした。")
+        _catalog = Catalog.from_json(*raw, sources=sources)
+        _catalog.save()
+        return _catalog
+
+def get_submissions_merge_contest_info(user, histories=None, catalog=None, cancel=None):
     """
     直近のユーザーの提出物とコンテストIDを紐づけて取得  
+    catalogを渡すとカタログを取得し直さない  
+    cancel: threading.Event。セットされたら提出の取得を中断する  
     { contest_id: submission[] }
     """
     if histories is None:
         histories = get_histories(user) # 直近のコンテスト履歴を取得
-    histories.sort(key=lambda x: time2epoch(x["date"])) # 日付順にソート
-    contest_datas = get_contests_information() # すべてのコンテスト情報を取得
-    submissions = []
-    ret = {}
+    sort_oldest_first(histories) # 日付順にソート
+    if catalog is None:
+        catalog = get_catalog() # すべてのコンテスト情報を取得
+    windows = []
     for history in histories:
         if len(history) < 6:
             continue
 
-        # コンテストデータをフィルターで取得
-        contest = list(filter(lambda x: x["id"] == history["contest_id"], contest_datas))[0]
-        if contest is None:
+        # コンテストの開始時刻と終了時刻を取得
+        window = catalog.window(history["contest_id"])
+        if window is None:
             continue
+        windows.append((history["contest_id"], *window))
 
-        # コンテストの開始時刻と終了時刻を取得
-        start_epoch = int(contest["start_epoch_second"])
-        end_epoch = start_epoch + int(contest["duration_second"])
-        
-        # コンテスト開始時間に合わせて提出物を取得(改めて必要な場合のみ取得)
-        if len(submissions) == 0 or submissions[-1]["epoch_second"] < end_epoch:
-            submissions = get_user_submissions(user, start_epoch)
-            print(f"epoch_seciond: {start_epoch} ~ {end_epoch}, submissions: {len(submissions)}")
-
-        submissions_filter = list(filter(lambda x: x["contest_id"] == history["contest_id"] and int(x["epoch_second"]) >= start_epoch and int(x["epoch_second"]) <= end_epoch, submissions))
-        ret[history["contest_id"]] = submissions_filter
+    if len(windows) == 0:
+        return {}
+
+    # 保存済みの提出以降のみ取得(必要な期間が保存済みなら通信しない)
+    store = get_submission_store()
+    from_second = min(window[1] for window in windows)
+    until = max(window[2] for window in windows)
+    added = store.sync(user, from_second, until=until, cancel=cancel)
+    print(f"epoch_second: {from_second} ~ {until}, new submissions: {added}", file=sys.stderr)
+
+    return join_submissions(store.between(user, from_second, until), windows)
+
+def calc_scores(similarities, target_value, target_status, values, status, least_diff=0):
+    """
+    難易度を考慮してスコアを計算する
+    similarities: 各問題との類似度, values/status: similaritiesに揃えた難易度の配列
+    """
+    # 対象の問題の難易度情報がなければ類似度をそのまま使う
+    if target_status == DIFFICULTY_MISSING:
+        return similarities
+    scores = similarities.copy()
+    correction = 200 if least_diff < 0 else 0
+    exists = status != DIFFICULTY_MISSING
+    has_none = exists & ((status == DIFFICULTY_NONE) | (target_status == DIFFICULTY_NONE))
+    has_value = exists & ~has_none
+    scores[has_value] -= np.abs((target_value - correction) - values[has_value]) / 3000
+    scores[has_none] = -1000
+    return scores
+
+def get_similarity_problems_batch(problem_ids, N=3, catalog=None, least_diff=0):
+    """
+    problem_idsの各問題に類似度の高い問題をNずつ返す。
+    catalogを渡すと難易度を考慮して返す。
+    近傍テーブルがある場合はその候補のみを並べ替える。
+    類似度は保存済みインデックス(対象の問題も含めた全解説でidfを計算)のもので、
+    対象の問題を除いてidfを計算していた元の実装とは順位が少し異なることがある。
+    { problem_id: (problem_id, score)[] }
+    """
+    index = get_similarity_index()
+
+    # IDの解説が存在しない場合空リスト
+    ret = {problem_id: [] for problem_id in problem_ids}
+    queries = [problem_id for problem_id in problem_ids if index.row(problem_id) is not None]
+    if len(queries) == 0:
+        return ret
+    rows = [index.row(problem_id) for problem_id in queries]
+    target_values, target_status = index.difficulty_arrays(catalog, rows)
+
+    if index.neighbor_ids is not None and N <= index.meta["neighbors_k"]:
+        for j, (problem_id, row) in enumerate(zip(queries, rows)):
+            candidates, similarities = index.neighbors(row)
+            values, status = index.difficulty_arrays(catalog, candidates)
+            scores = calc_scores(similarities, target_values[j], target_status[j], values, status, least_diff=least_diff)
+            # 同点の場合は行番号の昇順
+            top = np.lexsort((candidates, -scores))[:N]
+            ret[problem_id] = [(str(index.ids[candidates[i]]), float(similarities[i])) for i in top]
+        return ret
+
+    similarities = index.similarities_batch(rows)
+    values, status = index.difficulty_arrays(catalog)
+    for j, (problem_id, row) in enumerate(zip(queries, rows)):
+        scores = calc_scores(similarities[:, j], target_values[j], target_status[j], values, status, least_diff=least_diff)
+        top = top_n(scores, N, exclude=row)
+        ret[problem_id] = [(str(index.ids[i]), float(similarities[i, j])) for i in top]
     return ret
 
-def get_similarity_problems(problem_id, N=3, difficulty=None, least_diff=0):
+def get_similarity_problems(problem_id, N=3, catalog=None, least_diff=0):
     """
     problem_idの問題に類似度の高い問題をN返す。
-    difficultyを渡すと難易度を考慮して返す。(毎度difficultyを取得すると時間がかかるので引数で渡す。)
+    catalogを渡すと難易度を考慮して返す。
     (problem_id, score)[]
     """
-    problems_json = get_json("data/problems_editorial.json")
-    problems_json = {k: v for k, v in problems_json.items() if not v is None}
-
-    # IDの解説が存在しない場合空リストを返す
-    if not problem_id in problems_json:
-        return []
-    target = problems_json[problem_id]
-    del problems_json[problem_id]
-    
-    # テキストの前処理
-    def preprocess_text(text):
-        text = re.sub(r'\n', ' ', text).strip()
-        return text
-
-    processed_corpus = [preprocess_text(p["text"]) for p in problems_json.values()]
-    processed_target = preprocess_text(target["text"])
-
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix_corpus = vectorizer.fit_transform(processed_corpus)
-    tfidf_vector_target = vectorizer.transform([processed_target])
-
-    similarities = cosine_similarity(tfidf_matrix_corpus, tfidf_vector_target)
-
-    # for i, score in enumerate(similarities):
-    #     print(f"{list(problems_json.keys())[i]} score: {score[0]:.4f}")
-
-    def calc_score(target_id, score):
-        """
-        難易度を考慮してスコアを計算する
-        """
-        try :
-            problem_diff = difficulty[problem_id]["difficulty"]
-            target_diff = difficulty[target_id]["difficulty"]
-            if problem_diff is None or target_diff is None :
-                return -1000
-            
-            orrection = 200 if least_diff < 0 else 0
-            # print(f"problemID: {problem_id}, targetID: {target_id} diff: {abs(problem_diff - target_diff)} score: {score - (abs(problem_diff - target_diff) / 3000)}")
-            return score - (abs((problem_diff - orrection) - target_diff) / 3000)
-        except:
-            return score
-
-    scores = [(list(problems_json.keys())[i], s[0]) for i, s in enumerate(similarities)]
-    scores = sorted(scores, key=lambda x: calc_score(x[0], x[1]), reverse=True)
-    return scores[:N]
+    return get_similarity_problems_batch([problem_id], N=N, catalog=catalog, least_diff=least_diff)[problem_id]
 
-def get_recomend_problem(user, histories=None):
+def recomend_from_submissions(submissions_list, catalog, histories=None):
     """
-    不正解だった問題を元におすすめの問題のリストを返す  
-    return (id, score)[], difficulty (score降順にソート済み)
+    { contest_id: submission[] } の不正解だった問題を元におすすめの問題のリストを返す  
+    return (id, score)[] (score降順にソート済み)
     """
-    submissions_list = get_submissions_merge_contest_info(user, histories=histories)
     problems = set()
     for submissions in submissions_list.values():
         for submission in submissions:
@@ -289,29 +409,43 @@ def get_recomend_problem(user, histories=None):
             if result == "WA" or result == "TLE":
                 problems.add(submission["problem_id"])
 
-    difficulty = get_difficulties()
     if histories is None:
         least_diff = 0
     else:
         least_diff = histories[0]["diff"]
-    ret = sum([get_similarity_problems(p, difficulty=difficulty, least_diff=least_diff) for p in problems], [])
-    return sorted(ret, key=lambda x: x[1], reverse=True), difficulty
+    problems = list(problems)
+    similarity_problems = get_similarity_problems_batch(problems, catalog=catalog, least_diff=least_diff)
+    ret = [similarity_problem for p in problems for similarity_problem in similarity_problems[p]]
+    return sorted(ret, key=lambda x: x[1], reverse=True)
+
+def get_recomend_problem(user, histories=None, catalog=None):
+    """
+    不正解だった問題を元におすすめの問題のリストを返す  
+    catalogを渡すと取得し直さない  
+    return (id, score)[], catalog (score降順にソート済み)
+    """
+    if catalog is None:
+        catalog = get_catalog()
+    submissions_list = get_submissions_merge_contest_info(user, histories=histories, catalog=catalog)
+    return recomend_from_submissions(submissions_list, catalog, histories=histories), catalog
 
-def get_gemini_advice(user: str, ai_type: str, histories=None, recomend_problems=None, TEST=False):
+def get_gemini_advice(user: str, ai_type: str, histories=None, recomend_problems=None, stream=False):
+    """
+    streamがTrueの場合は回答を順に返すジェネレーターを返す
+    """
     if histories is None:
         histories = get_histories()
     if recomend_problems is None:
         recomend_problems, _diff = get_recomend_problem()
-    problems_json = get_json("data/problems_editorial.json")
+    store = get_editorial_store()
 
     recomend_problems_editorials = []
     for problem in recomend_problems:
-        problem_id = problem[0]
-        if not problem_id in problems_json:
-            continue
-        if problems_json[problem_id] is None:
+        # コードは使わないのでテキストのみ読み込む
+        text = store.get_text(problem[0])
+        if text is None:
             continue
-        recomend_problems_editorials.append(problems_json[problem_id]["text"])
+        recomend_problems_editorials.append(text)
 
     prompt = f"""
     ユーザーの競技プログラミングの成績がこちらです。
@@ -328,9 +462,80 @@ def get_gemini_advice(user: str, ai_type: str, histories=None, recomend_problems
     -----
     """
 
-    return use_gemini(prompt, TEST=TEST)
+    if stream:
+        return use_gemini_stream(prompt)
+    return use_gemini(prompt)
 
 
+def prefetch_persona_advices(user, ai_types, histories, recomend_problems, max_workers=3, on_advice=None, cancel=None):
+    """
+    複数のai_typeのアドバイスを並列に取得する(同時にmax_workersずつ)  
+    on_advice: 取得できたものから on_advice(ai_type, text) で通知する  
+    cancel: threading.Event。セットされたら残りは取得しない  
+    return { ai_type: text }
+    """
+    ret = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(get_gemini_advice, user, ai_type, histories=histories, recomend_problems=recomend_problems): ai_type
+            for ai_type in ai_types
+        }
+        for future in as_completed(futures):
+            if cancel is not None and cancel.is_set():
+                break
+            ai_type = futures[future]
+            ret[ai_type] = future.result()
+            if on_advice is not None:
+                on_advice(ai_type, ret[ai_type])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return ret
+
+def search_pipeline(user, ai_type, on_ai_chunk=None, cancel=None, previous=None):
+    """
+    検索の処理をパイプラインにしたもの(依存していない取得処理は並列に実行する)  
+    結果: histories, catalog, similarity_index, submissions, recomends, ai_text  
+    on_ai_chunk: 渡すとアドバイスを生成されたものから順に on_ai_chunk(text) で通知する  
+    cancel: threading.Event。セットされたら通信の合間に実行中のステージを中断し、アドバイスの受信をやめる  
+    previous: 前回の結果 { histories, recomends, catalog, advices }。コンテスト履歴が変わっていなければ提出・おすすめ問題・アドバイスは再利用する
+    """
+    def unchanged(histories):
+        return previous is not None and histories_key(histories) == histories_key(previous["histories"])
+
+    def submissions(histories, catalog):
+        if unchanged(histories):
+            sort_oldest_first(histories) # アドバイスのプロンプトを前回と揃える
+            return None
+        return get_submissions_merge_contest_info(user, histories=histories, catalog=catalog, cancel=cancel)
+
+    def recomends(histories, submissions, catalog, similarity_index):
+        if unchanged(histories):
+            return previous["recomends"]
+        return recomend_from_submissions(submissions, catalog, histories=histories)
+
+    def advice(histories, recomends):
+        if unchanged(histories) and ai_type in previous["advices"]:
+            return previous["advices"][ai_type]
+        if on_ai_chunk is None:
+            return get_gemini_advice(user, ai_type, histories=histories, recomend_problems=recomends)
+        chunks = []
+        for chunk in get_gemini_advice(user, ai_type, histories=histories, recomend_problems=recomends, stream=True):
+            if cancel is not None and cancel.is_set():
+                break
+            chunks.append(chunk)
+            on_ai_chunk(chunk)
+        return "".join(chunks) if chunks else None
+
+    pipeline = Pipeline(max_workers=6)
+    pipeline.add("histories", lambda: get_histories(user, cancel=cancel))
+    pipeline.add("catalog", lambda: get_catalog(cancel=cancel))
+    pipeline.add("similarity_index", get_similarity_index)
+    pipeline.add("submissions", submissions, deps=("histories", "catalog"))
+    pipeline.add("recomends", recomends, deps=("histories", "submissions", "catalog", "similarity_index"))
+    pipeline.add("ai_text", advice, deps=("histories", "recomends"))
+    return pipeline
+
 def run():
     # windowShow()
 
@@ -340,12 +545,13 @@ def run():
 
     difficulties = get_difficulties()
 
-    use_gemini("""リンゴの魅力について簡潔に教えてください。""", TEST=True)
+    use_gemini("""リンゴの魅力について簡潔に教えてください。""")
 
 
 if __name__ == "__main__":
-    # if TEST:
-    #     print("テストモードで実行しています。")
+    # オフラインで実行する場合は TRANSPORT_MODE=replay(記録は TRANSPORT_MODE=record)
+    if os.getenv("TRANSPORT_MODE", "live") != "live":
+        print(f"{os.getenv('TRANSPORT_MODE')}モードで実行しています。")
 
 
     run()
@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class PipelineCancelled(Exception):
+    """
+    パイプラインが中断された
+    """
+
+def check_cancelled(cancel):
+    """
+    cancel(threading.Event)がセットされていればPipelineCancelledを投げる(ステージの中で通信の合間に呼ぶ)
+    """
+    if cancel is not None and cancel.is_set():
+        raise PipelineCancelled()
+
+class Pipeline:
+    """
+    依存関係のある処理(ステージ)を、依存していないものから並列に実行する
+    各ステージの関数は依存するステージの結果をキーワード引数で受け取る
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.stages = {}
+
+    def add(self, name, fn, deps=()):
+        """
+        ステージを追加する(depsは追加済みのステージ名)
+        """
+        for dep in deps:
+            if not dep in self.stages:
+                raise ValueError(f"未定義のステージです: {dep}")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def run(self, on_stage=None, cancel=None):
+        """
+        すべてのステージを実行する(いずれかが失敗したら残りは実行せずに例外を投げる)  
+        on_stage: ステージが終わるたびに on_stage(name, result) を呼ぶ  
+        cancel: threading.Event。セットされたら実行中のステージを待たずにPipelineCancelledを投げる
+        """
+        results = {}
+        timings = {}
+        start = time.perf_counter()
+        waiting = dict(self.stages)
+        running = {}
+
+        def submit_ready(executor):
+            for name, (fn, deps) in list(waiting.items()):
+                if all(dep in results for dep in deps):
+                    del waiting[name]
+                    kwargs = {dep: results[dep] for dep in deps}
+                    running[executor.submit(self._timed, fn, kwargs, start)] = name
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            submit_ready(executor)
+            while running:
+                done, _pending = wait(running, timeout=0.1, return_when=FIRST_COMPLETED)
+                if cancel is not None and cancel.is_set():
+                    raise PipelineCancelled()
+                for future in done:
+                    name = running.pop(future)
+                    results[name], timings[name] = future.result()
+                    if on_stage is not None:
+                        on_stage(name, results[name])
+                submit_ready(executor)
+        finally:
+            # 失敗・中断した場合は実行中のステージの終了を待たない
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return PipelineResult(results, timings, {name: deps for name, (_fn, deps) in self.stages.items()}, time.perf_counter() - start)
+
+    @staticmethod
+    def _timed(fn, kwargs, origin):
+        stage_start = time.perf_counter()
+        result = fn(**kwargs)
+        return result, (stage_start - origin, time.perf_counter() - origin)
+
+class PipelineResult:
+    """
+    パイプラインの実行結果
+    timings: { name: (開始時刻, 終了時刻) } (パイプライン開始からの秒数)
+    """
+
+    def __init__(self, results, timings, deps, elapsed):
+        self.results = results
+        self.timings = timings
+        self.deps = deps
+        self.elapsed = elapsed
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def critical_path(self):
+        """
+        最後に終わったステージから、各ステージで最後に終わった依存先をたどった経路
+        return (ステージ名[], 経路上の処理時間の合計)
+        """
+        if len(self.timings) == 0:
+            return [], 0.0
+        name = max(self.timings, key=lambda x: self.timings[x][1])
+        path = [name]
+        while self.deps[name]:
+            name = max(self.deps[name], key=lambda x: self.timings[x][1])
+            path.append(name)
+        path.reverse()
+        return path, sum(self.timings[name][1] - self.timings[name][0] for name in path)
+
+    def report(self):
+        """
+        各ステージの処理時間とクリティカルパスの文字列
+        """
+        lines = [f"{name}: {start:.2f}s ~ {end:.2f}s ({end - start:.2f}s)" for name, (start, end) in sorted(self.timings.items(), key=lambda x: x[1])]
+        path, latency = self.critical_path()
+        lines.append(f"critical path: {' -> '.join(path)} ({latency:.2f}s), total: {self.elapsed:.2f}s")
+        return "\n".join(lines)
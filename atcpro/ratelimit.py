@@ -0,0 +1,33 @@
+import threading
+import time
+
+class TokenBucket:
+    """
+    トークンバケットによるレート制限(スレッドセーフ)
+    rate: 1秒あたりに補充されるトークン数, capacity: 貯められるトークンの上限
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        トークンが貯まるまで待ってから消費する
+        return 待った秒数
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
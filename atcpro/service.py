@@ -0,0 +1,330 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SERVICE_PORT = 8090
+LATENCY_WINDOW = 10000 # エンドポイントごとに保持する処理時間の件数
+
+def percentile(values, q):
+    """
+    ソート済みのvaluesのq(0~1)分位点
+    """
+    if len(values) == 0:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+class Coalescer:
+    """
+    同じキーの処理が実行中ならそれを待って結果を共有する(同時に来た同じ問い合わせを1回にまとめる)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.coalesced = 0
+
+    def run(self, key, fn):
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+class RecommendService:
+    """
+    カタログ・類似度インデックス・解説データを読み込んだままにして問い合わせに答える
+    """
+
+    def __init__(self):
+        self.coalescer = Coalescer()
+        self.lock = threading.Lock()
+        self.latencies = {}
+
+    def warm_up(self):
+        """
+        最初の問い合わせを待たせないように読み込んでおく
+        """
+        from editorial_store import get_editorial_store
+        from main import get_catalog
+        from similarity import get_similarity_index
+
+        start = time.perf_counter()
+        get_catalog()
+        get_similarity_index()
+        get_editorial_store()
+        return time.perf_counter() - start
+
+    def recommend(self, user, N=10):
+        from batch import recommend_user
+        from main import get_catalog
+
+        return recommend_user(user, get_catalog(), N=N)
+
+    def similar(self, problem_id, n=3):
+        from main import get_catalog, get_similarity_problems
+
+        return {
+            "problem_id": problem_id,
+            "similar": [{"problem_id": id, "score": score} for id, score in get_similarity_problems(problem_id, N=n, catalog=get_catalog())],
+        }
+
+    def history(self, user, N=10, since=None, until=None):
+        from main import get_histories
+
+        return {"user": user, "histories": get_histories(user, N=N, since=since, until=until)}
+
+    def handle(self, path, params):
+        """
+        return (ステータスコード, レスポンスのJSON)
+        """
+        def arg(name, type=str, default=None, required=False):
+            if not name in params:
+                if required:
+                    raise ValueError(f"{name}を指定してください。")
+                return default
+            return type(params[name][0])
+
+        def count(name, default):
+            value = arg(name, int, default)
+            if value < 1:
+                raise ValueError(f"{name}は1以上を指定してください。")
+            return value
+
+        if path == "/recommend":
+            user, N = arg("user", required=True), count("n", 10)
+            return 200, self.coalescer.run(("recommend", user, N), lambda: self.recommend(user, N))
+        if path == "/similar":
+            problem_id, n = arg("problem_id", required=True), count("n", 3)
+            return 200, self.coalescer.run(("similar", problem_id, n), lambda: self.similar(problem_id, n))
+        if path == "/history":
+            user, N, since, until = arg("user", required=True), count("n", 10), arg("since", int), arg("until", int)
+            return 200, self.coalescer.run(("history", user, N, since, until), lambda: self.history(user, N, since, until))
+        if path == "/stats":
+            return 200, self.stats()
+        return 404, {"error": f"not found: {path}"}
+
+    def record(self, path, elapsed):
+        with self.lock:
+            self.latencies.setdefault(path, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+
+    def stats(self):
+        """
+        エンドポイントごとの件数と処理時間(p50, p99)、まとめた問い合わせの数
+        """
+        with self.lock:
+            latencies = {path: sorted(values) for path, values in self.latencies.items()}
+        return {
+            "coalesced": self.coalescer.coalesced,
+            "endpoints": {
+                path: {"count": len(values), "p50": percentile(values, 0.5), "p99": percentile(values, 0.99)}
+                for path, values in latencies.items()
+            },
+        }
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET /recommend?user=&n=, /similar?problem_id=&n=, /history?user=&n=&since=&until=, /stats
+    """
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        try:
+            status, body = self.service.handle(url.path, parse_qs(url.query))
+        except ValueError as e:
+            status, body = 400, {"error": str(e)}
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if status == 200 and url.path != "/stats":
+            self.service.record(url.path, time.perf_counter() - start)
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # 既定の5では同時接続が多いと接続待ちで遅くなる
+
+def start_service(port=SERVICE_PORT, host="127.0.0.1", warm_up=True):
+    """
+    サービスを別スレッドで起動する
+    return サーバー(server.server_address[1]がポート番号)
+    """
+    service = RecommendService()
+    if warm_up:
+        print(f"warm up: {service.warm_up():.2f}s")
+    handler = type("Handler", (ServiceHandler,), {"service": service})
+    server = ServiceServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class ServiceClient:
+    """
+    サービスを使うクライアント(GUIのバックエンド用)
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def get(self, path, **params):
+        from transport import get_transport
+
+        params = {key: value for key, value in params.items() if value is not None}
+        res = get_transport().get(f"{self.base_url}{path}", params=params)
+        res.raise_for_status()
+        return res.json()
+
+    def history(self, user, N=10, since=None, until=None):
+        return self.get("/history", user=user, n=N, since=since, until=until)["histories"]
+
+    def recommend(self, user, N=10):
+        return self.get("/recommend", user=user, n=N)
+
+    def similar(self, problem_id, n=3):
+        return [(problem["problem_id"], problem["score"]) for problem in self.get("/similar", problem_id=problem_id, n=n)["similar"]]
+
+class CardCatalog:
+    """
+    サービスが返したおすすめ問題の表示情報(Catalog.cardの代わり)
+    """
+
+    def __init__(self, problems):
+        self.cards = {problem["problem_id"]: (problem["problem_id"], problem["name"], problem["diff"], problem["url"]) for problem in problems if problem["name"] is not None}
+
+    def card(self, problem_id):
+        return self.cards.get(problem_id)
+
+def service_pipeline(base_url, user, ai_type, on_ai_chunk=None, cancel=None, previous=None):
+    """
+    search_pipelineのサービス版(コンテスト履歴とおすすめ問題はサービスから取得し、アドバイスはローカルで作る)
+    結果: histories, recomends, catalog, ai_text
+    """
+    from history_store import sort_oldest_first
+    from main import get_gemini_advice
+    from pipeline import Pipeline, check_cancelled
+    from session import histories_key
+
+    client = ServiceClient(base_url)
+
+    def unchanged(histories):
+        return previous is not None and histories_key(histories) == histories_key(previous["histories"])
+
+    def recommend(histories):
+        # search_pipelineと同じく、アドバイスには古い順に並べ替えた履歴を渡す
+        sort_oldest_first(histories)
+        if unchanged(histories):
+            return None
+        check_cancelled(cancel)
+        return client.recommend(user)["recomends"]
+
+    def recomends(histories, recommend, catalog):
+        if recommend is None:
+            return previous["recomends"]
+        return [(problem["problem_id"], problem["score"]) for problem in recommend]
+
+    def catalog(recommend):
+        if recommend is None:
+            return previous["catalog"]
+        return CardCatalog(recommend)
+
+    def advice(histories, recomends):
+        if unchanged(histories) and ai_type in previous["advices"]:
+            return previous["advices"][ai_type]
+        if on_ai_chunk is None:
+            return get_gemini_advice(user, ai_type, histories=histories, recomend_problems=recomends)
+        chunks = []
+        for chunk in get_gemini_advice(user, ai_type, histories=histories, recomend_problems=recomends, stream=True):
+            if cancel is not None and cancel.is_set():
+                break
+            chunks.append(chunk)
+            on_ai_chunk(chunk)
+        return "".join(chunks) if chunks else None
+
+    pipeline = Pipeline(max_workers=3)
+    pipeline.add("histories", lambda: client.history(user))
+    pipeline.add("recommend", recommend, deps=("histories",))
+    pipeline.add("catalog", catalog, deps=("recommend",))
+    # GUIはカタログを引いておすすめ問題を表示するので、カタログの後に終わるようにする
+    pipeline.add("recomends", recomends, deps=("histories", "recommend", "catalog"))
+    pipeline.add("ai_text", advice, deps=("histories", "recomends"))
+    return pipeline
+
+def load_test(base_url, paths, requests=200, concurrency=16):
+    """
+    pathsを順に、concurrency並列でrequests回問い合わせて処理時間(p50, p99)とスループットを表示する
+    """
+    def fetch(path):
+        start = time.perf_counter()
+        with urllib.request.urlopen(f"{base_url.rstrip('/')}{path}") as res:
+            res.read()
+        return path, time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = {}
+    errors = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(fetch, paths[i % len(paths)]) for i in range(requests)]
+        for future in futures:
+            try:
+                path, elapsed = future.result()
+            except Exception:
+                errors += 1
+                continue
+            latencies.setdefault(path, []).append(elapsed)
+    elapsed = time.perf_counter() - start
+
+    for path, values in latencies.items():
+        values.sort()
+        print(f"{path}: {len(values)} requests, p50 {percentile(values, 0.5) * 1000:.1f}ms, p99 {percentile(values, 0.99) * 1000:.1f}ms")
+    print(f"total: {requests} requests ({errors} errors) in {elapsed:.2f}s, {requests / elapsed:.1f} requests/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="おすすめ問題のサービス")
+    parser.add_argument("command", choices=("serve", "load"))
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{SERVICE_PORT}", help="loadで問い合わせるサービス")
+    parser.add_argument("--path", action="append", help="loadで問い合わせるパス(複数指定できる)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = start_service(args.port)
+        print(f"ATCPRO_SERVICE=http://127.0.0.1:{server.server_address[1]}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "load":
+        load_test(args.url, args.path or ["/stats"], requests=args.requests, concurrency=args.concurrency)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+SESSION_TTL = 600 # 秒数(環境変数SESSION_TTLで変更できる)
+
+def histories_key(histories):
+    """
+    コンテスト履歴が変わったかどうかの比較用のキー(並び順によらない)
+    """
+    if histories is None:
+        return None
+    return tuple(sorted((history["contest_id"], history["date"], history["rating"]) for history in histories))
+
+class UserSession:
+    """
+    ユーザーごとの検索結果
+    histories: コンテスト履歴(新しい順), recomends: おすすめ問題, catalog: 問題・コンテスト情報と難易度(Catalog)
+    advices: { ai_type: アドバイス }
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.histories = None
+        self.recomends = None
+        self.catalog = None
+        self.advices = {}
+        self.updated_at = None
+
+    def is_complete(self):
+        """
+        画面の表示に必要な結果がそろっているか
+        """
+        return self.updated_at is not None
+
+    def is_stale(self, ttl):
+        return not self.is_complete() or time.time() - self.updated_at >= ttl
+
+    def is_changed(self, histories):
+        """
+        保存しているものとコンテスト履歴が変わったか
+        """
+        return histories_key(histories) != histories_key(self.histories)
+
+    def discard_advices_if_changed(self, histories):
+        """
+        コンテスト履歴が変わっていたら取得済みのアドバイスを捨てる
+        """
+        if self.is_changed(histories):
+            self.advices = {}
+
+    def update(self, histories, recomends, catalog):
+        """
+        検索結果で更新する(アドバイスはコンテスト履歴を取得した時点でdiscard_advices_if_changedで捨てておく)
+        """
+        self.histories = histories
+        self.recomends = recomends
+        self.catalog = catalog
+        self.updated_at = time.time()
+
+    def previous(self):
+        """
+        search_pipelineに渡す前回の結果
+        """
+        if not self.is_complete():
+            return None
+        return {
+            "histories": list(self.histories),
+            "recomends": self.recomends,
+            "catalog": self.catalog,
+            "advices": dict(self.advices),
+        }
+
+    def advice_context(self):
+        """
+        アドバイスの作成に使う(コンテスト履歴(古い順), おすすめ問題)
+        """
+        return self.histories[::-1], self.recomends
+
+class SessionCache:
+    """
+    ユーザーごとのUserSession
+    ttlを過ぎたものは表示に使いつつ裏で更新する(stale-while-revalidate)
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = int(os.getenv("SESSION_TTL", SESSION_TTL)) if ttl is None else ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, user):
+        """
+        userのセッション(なければ作る)
+        """
+        with self.lock:
+            if not user in self.sessions:
+                self.sessions[user] = UserSession(user)
+            return self.sessions[user]
+
+    def is_stale(self, session):
+        return session.is_stale(self.ttl)
+
+    def invalidate(self, user):
+        with self.lock:
+            self.sessions.pop(user, None)
+
+_cache = None
+_cache_lock = threading.Lock()
+def get_session_cache():
+    """
+    プロセス内で共有するSessionCacheを取得する
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SessionCache()
+        return _cache
@@ -0,0 +1,476 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import numpy as np
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+INDEX_DIR = "data/similarity"
+NEIGHBORS_K = 50
+INDEX_CHECK_INTERVAL = 5.0 # 秒。解説データの更新を確かめる間隔(環境変数SIMILARITY_CHECK_INTERVALで変更できる)
+
+def preprocess_text(text):
+    """
+    テキストの前処理
+    """
+    text = re.sub(r'\n', ' ', text).strip()
+    return text
+
+def editorial_fingerprint():
+    """
+    解説データの更新を検知するための情報
+    """
+    from editorial_store import get_editorial_store
+
+    return get_editorial_store().fingerprint()
+
+def save_npy(path, array):
+    """
+    一時ファイルに書き込んでから置き換える(メモリマップで読み込み中のファイルを壊さないため)
+    """
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(f"{path}.tmp", path)
+
+# 難易度の状態
+DIFFICULTY_MISSING = 0 # 難易度情報が存在しない
+DIFFICULTY_NONE = 1 # 難易度がNone
+DIFFICULTY_VALUE = 2 # 難易度あり
+
+def top_n(scores, N, exclude=None):
+    """
+    scoresの降順に上位N個のインデックスを返す(同点はインデックスの昇順)
+    excludeのインデックスは結果に含めない
+    """
+    size = len(scores)
+    if exclude is not None:
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+        size -= 1
+    N = min(N, size)
+    if N <= 0:
+        return np.array([], dtype=np.int64)
+    if N < len(scores):
+        # N番目のスコア以上の候補だけを並べ替える(同点の順序を保つため)
+        part = np.argpartition(-scores, N - 1)[:N]
+        candidates = np.flatnonzero(scores >= scores[part].min())
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:N]
+
+class SimilarityIndex:
+    """
+    解説テキストのTF-IDFインデックス
+    ids[i] の問題が matrix の i 行目に対応する(各行はL2正規化済み)
+    """
+
+    def __init__(self, ids, matrix, vocabulary, idf, meta, neighbor_ids=None, neighbor_scores=None, df=None):
+        self.ids = ids
+        self.matrix = matrix
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.meta = meta
+        # 各単語の文書頻度(追加された問題を含む。idfは作成時のまま固定する)
+        self.df = np.bincount(matrix.indices, minlength=len(vocabulary)) if df is None else df
+        # 近傍テーブル: neighbor_ids[i] が i 行目の問題の類似度上位K件の行番号(類似度の降順)
+        self.neighbor_ids = neighbor_ids
+        self.neighbor_scores = neighbor_scores
+        self.rows = {str(problem_id): i for i, problem_id in enumerate(ids)}
+        self.catalog_problem_rows = None # (catalog, idsの各問題のcatalogでの番号)
+
+    @classmethod
+    def build(cls, texts, fingerprint=None):
+        """
+        (problem_id, text)[] からインデックスを作成する
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        ids = []
+        corpus = []
+        for problem_id, text in texts:
+            ids.append(problem_id)
+            corpus.append(preprocess_text(text))
+        ids = np.array(ids, dtype=str)
+
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(corpus).tocsr()
+        matrix.sort_indices()
+        vocabulary = {term: int(col) for term, col in vectorizer.vocabulary_.items()}
+        meta = {
+            "n_docs": len(ids),
+            "n_terms": len(vocabulary),
+            "built_at": int(time.time()),
+            "fingerprint": fingerprint,
+        }
+        return cls(ids, matrix, vocabulary, vectorizer.idf_, meta)
+
+    def save(self, path=INDEX_DIR):
+        """
+        インデックスをディレクトリに保存する
+        """
+        index_path = f"{MODULE_PATH}/{path}"
+        os.makedirs(index_path, exist_ok=True)
+        save_npy(f"{index_path}/ids.npy", self.ids)
+        save_npy(f"{index_path}/data.npy", self.matrix.data)
+        save_npy(f"{index_path}/indices.npy", self.matrix.indices)
+        save_npy(f"{index_path}/indptr.npy", self.matrix.indptr)
+        save_npy(f"{index_path}/idf.npy", self.idf)
+        save_npy(f"{index_path}/df.npy", self.df)
+        with open(f"{index_path}/vocabulary.json", "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        if self.neighbor_ids is not None:
+            save_npy(f"{index_path}/neighbor_ids.npy", self.neighbor_ids)
+            save_npy(f"{index_path}/neighbor_scores.npy", self.neighbor_scores)
+        # meta.jsonは最後に書き込む(途中で失敗した場合は古いインデックス扱いになる)
+        with open(f"{index_path}/meta.json", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=4)
+
+    @classmethod
+    def load(cls, path=INDEX_DIR, mmap=True):
+        """
+        保存済みのインデックスを読み込む(既定ではメモリマップで読み込む)
+        """
+        index_path = f"{MODULE_PATH}/{path}"
+        mmap_mode = "r" if mmap else None
+        with open(f"{index_path}/meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(f"{index_path}/vocabulary.json", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        ids = np.load(f"{index_path}/ids.npy", mmap_mode=mmap_mode)
+        data = np.load(f"{index_path}/data.npy", mmap_mode=mmap_mode)
+        indices = np.load(f"{index_path}/indices.npy", mmap_mode=mmap_mode)
+        indptr = np.load(f"{index_path}/indptr.npy", mmap_mode=mmap_mode)
+        idf = np.load(f"{index_path}/idf.npy", mmap_mode=mmap_mode)
+        from scipy.sparse import csr_matrix # 起動を速くするため使うときに読み込む
+        matrix = csr_matrix((data, indices, indptr), shape=(len(ids), len(vocabulary)), copy=False)
+        neighbor_ids, neighbor_scores = None, None
+        if "neighbors_k" in meta:
+            neighbor_ids = np.load(f"{index_path}/neighbor_ids.npy", mmap_mode=mmap_mode)
+            neighbor_scores = np.load(f"{index_path}/neighbor_scores.npy", mmap_mode=mmap_mode)
+        df = None
+        if os.path.exists(f"{index_path}/df.npy"):
+            df = np.load(f"{index_path}/df.npy")
+        return cls(ids, matrix, vocabulary, idf, meta, neighbor_ids, neighbor_scores, df)
+
+    @staticmethod
+    def exists(path=INDEX_DIR):
+        return os.path.exists(f"{MODULE_PATH}/{path}/meta.json")
+
+    def is_stale(self, fingerprint=None):
+        """
+        解説データがインデックス作成時から更新されていればTrue
+        """
+        if fingerprint is None:
+            fingerprint = editorial_fingerprint()
+        return self.meta.get("fingerprint") != fingerprint
+
+    def row(self, problem_id):
+        """
+        problem_idの行番号(存在しない場合None)
+        """
+        return self.rows.get(problem_id)
+
+    def similarities(self, row):
+        """
+        row行目の問題と全問題のコサイン類似度
+        """
+        return (self.matrix @ self.matrix[row].T).toarray().ravel()
+
+    def similarities_batch(self, rows):
+        """
+        rowsの各問題と全問題のコサイン類似度 (len(ids), len(rows))
+        """
+        return (self.matrix @ self.matrix[rows].T).toarray()
+
+    def build_neighbors(self, k=NEIGHBORS_K, block_size=256):
+        """
+        全問題について類似度上位k件の近傍テーブルを作成する
+        n×nの行列を作らないようにblock_size行ずつ計算する
+        """
+        n = len(self.ids)
+        k = max(min(k, n - 1), 0)
+        neighbor_ids = np.zeros((n, k), dtype=np.int32)
+        neighbor_scores = np.zeros((n, k), dtype=np.float32)
+        matrix_t = self.matrix.T.tocsc()
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            block = (self.matrix[start:end] @ matrix_t).toarray()
+            for i, scores in enumerate(block):
+                top = top_n(scores, k, exclude=start + i)
+                neighbor_ids[start + i] = top
+                neighbor_scores[start + i] = scores[top]
+        self.neighbor_ids = neighbor_ids
+        self.neighbor_scores = neighbor_scores
+        self.meta["neighbors_k"] = k
+
+    def transform(self, texts):
+        """
+        作成時の語彙とidfのままテキストをベクトル化する(語彙にない単語は無視する)
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        from sklearn.preprocessing import normalize
+
+        counts = CountVectorizer(vocabulary=self.vocabulary).transform([preprocess_text(text) for text in texts])
+        matrix = normalize(counts.multiply(np.asarray(self.idf)).tocsr())
+        matrix.sort_indices()
+        return matrix
+
+    def append(self, texts):
+        """
+        追加された問題をインデックスと近傍テーブルに追加する
+        既存の問題(解説が置き換えられたもの)はベクトルを計算し直し、影響する近傍のみ更新する
+        texts: (problem_id, text)[]
+        return 追加・更新した問題数
+        """
+        texts = dict(texts)
+        updated = {problem_id: text for problem_id, text in texts.items() if problem_id in self.rows}
+        texts = {problem_id: text for problem_id, text in texts.items() if not problem_id in self.rows}
+        n_updated = self.replace(updated) if len(updated) > 0 else 0
+        if len(texts) == 0:
+            return n_updated
+
+        new_ids = np.array(list(texts.keys()), dtype=str)
+        new_matrix = self.transform(list(texts.values()))
+        start = len(self.ids)
+        from scipy.sparse import csr_matrix
+
+        self.df = self.df + np.bincount(new_matrix.indices, minlength=len(self.vocabulary))
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.matrix = csr_matrix((
+            np.concatenate([self.matrix.data, new_matrix.data]),
+            np.concatenate([self.matrix.indices, new_matrix.indices]),
+            np.concatenate([self.matrix.indptr, new_matrix.indptr[1:] + self.matrix.indptr[-1]]),
+        ), shape=(len(self.ids), len(self.vocabulary)))
+        for i, problem_id in enumerate(new_ids):
+            self.rows[str(problem_id)] = start + i
+
+        if self.neighbor_ids is not None:
+            self.append_neighbors(start)
+
+        self.meta["n_docs"] = len(self.ids)
+        self.meta["n_appended"] = self.meta.get("n_appended", 0) + len(new_ids)
+        return n_updated + len(new_ids)
+
+    def replace(self, texts):
+        """
+        既存の問題のベクトルを計算し直す
+        texts: { problem_id: text }
+        return 更新した問題数
+        """
+        from scipy.sparse import vstack
+
+        rows = np.array([self.rows[problem_id] for problem_id in texts], dtype=np.int64)
+        new_matrix = self.transform(list(texts.values()))
+        self.df = (self.df
+            - np.bincount(self.matrix[rows].indices, minlength=len(self.vocabulary))
+            + np.bincount(new_matrix.indices, minlength=len(self.vocabulary)))
+
+        # 置き換える行の前後をそのまま使って積み直す
+        blocks = []
+        prev = 0
+        for j in np.argsort(rows):
+            blocks.append(self.matrix[prev:rows[j]])
+            blocks.append(new_matrix[j])
+            prev = rows[j] + 1
+        blocks.append(self.matrix[prev:])
+        self.matrix = vstack(blocks, format="csr")
+        self.matrix.sort_indices()
+
+        if self.neighbor_ids is not None:
+            self.update_neighbors(rows)
+        self.meta["n_updated"] = self.meta.get("n_updated", 0) + len(rows)
+        return len(rows)
+
+    def update_neighbors(self, rows, block_size=256):
+        """
+        rows行目の問題のベクトルが変わった場合に、近傍が変わりうる問題の近傍を計算し直す
+        - rowsの問題自身
+        - 近傍にrowsの問題を含む問題(類似度が下がると近傍から外れうる)
+        - rowsの問題との類似度が近傍の最小値を超える問題
+        """
+        k = self.meta["neighbors_k"]
+        neighbor_ids = np.array(self.neighbor_ids)
+        neighbor_scores = np.array(self.neighbor_scores)
+        scores = (self.matrix @ self.matrix[rows].T).toarray()
+        threshold = neighbor_scores[:, -1] if k > 0 else np.zeros(len(self.ids), dtype=np.float32)
+        affected = np.isin(neighbor_ids, rows).any(axis=1) | (scores.max(axis=1, initial=-np.inf) > threshold)
+        affected[rows] = True
+
+        matrix_t = self.matrix.T.tocsc()
+        targets = np.flatnonzero(affected)
+        for start in range(0, len(targets), block_size):
+            block_rows = targets[start:start + block_size]
+            block = (self.matrix[block_rows] @ matrix_t).toarray()
+            for row, row_scores in zip(block_rows, block):
+                top = top_n(row_scores, k, exclude=row)
+                neighbor_ids[row] = top
+                neighbor_scores[row] = row_scores[top]
+        self.neighbor_ids = neighbor_ids
+        self.neighbor_scores = neighbor_scores
+
+    def append_neighbors(self, start):
+        """
+        start行目以降に追加された問題の近傍を計算し、既存の問題の近傍に追加された問題を反映する
+        """
+        n = len(self.ids)
+        k = self.meta["neighbors_k"]
+        new_rows = np.arange(start, n)
+        # (全問題, 追加された問題) の類似度
+        scores = (self.matrix @ self.matrix[start:].T).toarray().astype(np.float32)
+
+        neighbor_ids = np.zeros((n, k), dtype=np.int32)
+        neighbor_scores = np.zeros((n, k), dtype=np.float32)
+        neighbor_ids[:start] = self.neighbor_ids
+        neighbor_scores[:start] = self.neighbor_scores
+
+        # 既存の問題: 近傍の最小値を超える追加問題があればマージする
+        threshold = neighbor_scores[:start, -1] if k > 0 else np.zeros(start, dtype=np.float32)
+        for row in np.flatnonzero(scores[:start].max(axis=1, initial=-np.inf) > threshold):
+            candidates = np.concatenate([neighbor_ids[row], new_rows])
+            candidate_scores = np.concatenate([neighbor_scores[row], scores[row]])
+            top = top_n(candidate_scores, k)
+            neighbor_ids[row] = candidates[top]
+            neighbor_scores[row] = candidate_scores[top]
+
+        # 追加された問題: 全問題から近傍を計算する
+        for j, row in enumerate(new_rows):
+            top = top_n(scores[:, j], k, exclude=row)
+            neighbor_ids[row] = top
+            neighbor_scores[row] = scores[top, j]
+
+        self.neighbor_ids = neighbor_ids
+        self.neighbor_scores = neighbor_scores
+
+    def neighbors(self, row):
+        """
+        row行目の問題の近傍(行番号, 類似度)。近傍テーブルがなければNone
+        """
+        if self.neighbor_ids is None:
+            return None
+        return self.neighbor_ids[row], self.neighbor_scores[row].astype(np.float64)
+
+    def catalog_rows(self, catalog):
+        """
+        idsの各問題のcatalogでの番号(ない場合-1)。catalogかidsが変わるまで使いまわす
+        """
+        cached = self.catalog_problem_rows
+        if cached is None or cached[0] is not catalog or len(cached[1]) != len(self.ids):
+            cached = (catalog, catalog.problem_rows(self.ids))
+            self.catalog_problem_rows = cached
+        return cached[1]
+
+    def difficulty_arrays(self, catalog, rows=None):
+        """
+        idsに揃えた難易度の配列と状態の配列(DIFFICULTY_*)を返す
+        rowsを渡すとその行の問題のみ
+        """
+        if catalog is None:
+            n = len(self.ids) if rows is None else len(rows)
+            return np.zeros(n, dtype=np.float64), np.full(n, DIFFICULTY_MISSING, dtype=np.int8)
+        problems = self.catalog_rows(catalog)
+        if rows is not None:
+            problems = problems[np.asarray(rows, dtype=np.int64)]
+        return catalog.difficulty_arrays(problems)
+
+def build_index(path=INDEX_DIR, k=NEIGHBORS_K):
+    """
+    解説データからインデックスと近傍テーブルを作り直して保存する
+    """
+    from editorial_store import get_editorial_store
+
+    store = get_editorial_store()
+    fingerprint = store.fingerprint()
+    index = SimilarityIndex.build(store.iter_texts(), fingerprint=fingerprint)
+    index.build_neighbors(k)
+    index.save(path)
+    return SimilarityIndex.load(path)
+
+_index = None
+_index_checked = 0.0 # 最後に古くないことを確かめた時刻(time.monotonic)
+_index_lock = threading.Lock()
+def get_similarity_index():
+    """
+    インデックスを取得する(プロセス内で一度だけ読み込み、古い場合は作り直す)
+    古い場合はまずディスクから読み込み直す(クローラーが追加したものがあればそれを使う)
+    解説データの更新はINDEX_CHECK_INTERVAL秒ごとに確かめ、ロックは読み込み・作り直しが必要なときだけ取る
+    """
+    global _index, _index_checked
+    index = _index
+    if index is not None:
+        now = time.monotonic()
+        if now - _index_checked < float(os.getenv("SIMILARITY_CHECK_INTERVAL", INDEX_CHECK_INTERVAL)):
+            return index
+        if not index.is_stale(editorial_fingerprint()):
+            _index_checked = now
+            return index
+
+    with _index_lock:
+        # 待っている間に別のスレッドが読み込み・作り直しをしていればそれを使う
+        if _index is None and SimilarityIndex.exists():
+            _index = SimilarityIndex.load()
+        if _index is not None:
+            fingerprint = editorial_fingerprint()
+            if not _index.is_stale(fingerprint):
+                _index_checked = time.monotonic()
+                return _index
+            if SimilarityIndex.exists():
+                index = SimilarityIndex.load()
+                if not index.is_stale(fingerprint):
+                    _index = index
+                    _index_checked = time.monotonic()
+                    return _index
+        print("類似度インデックスを作成しています...", file=sys.stderr)
+        _index = build_index()
+        _index_checked = time.monotonic()
+        return _index
+
+def update_index(problems_json, path=INDEX_DIR):
+    """
+    追加・置き換えられた解説をインデックスに反映して保存する(クローラーからバッチごとに呼ぶ)
+    problems_json: { problem_id: { text, codes } }
+    """
+    global _index, _index_checked
+    with _index_lock:
+        if not SimilarityIndex.exists(path):
+            _index = build_index(path)
+            _index_checked = time.monotonic()
+            return _index
+        index = SimilarityIndex.load(path)
+        index.append((problem_id, data["text"]) for problem_id, data in problems_json.items() if not data is None)
+        index.meta["fingerprint"] = editorial_fingerprint()
+        index.save(path)
+        _index = SimilarityIndex.load(path)
+        _index_checked = time.monotonic()
+        return _index
+
+def main():
+    parser = argparse.ArgumentParser(description="解説テキストの類似度インデックス")
+    parser.add_argument("command", choices=("rebuild", "neighbors", "status"))
+    parser.add_argument("-k", type=int, default=NEIGHBORS_K, help="近傍テーブルの件数")
+    parser.add_argument("--block-size", type=int, default=256, help="近傍テーブルを計算する行数の単位")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        start = time.perf_counter()
+        index = build_index(k=args.k)
+        print(f"rebuild: {index.meta['n_docs']} docs, {index.meta['n_terms']} terms ({time.perf_counter() - start:.2f}s)")
+    elif args.command == "neighbors":
+        # 既存のインデックスから近傍テーブルのみ作り直す
+        start = time.perf_counter()
+        index = get_similarity_index()
+        index.build_neighbors(args.k, block_size=args.block_size)
+        index.save()
+        print(f"neighbors: {index.meta['n_docs']} docs, k={index.meta['neighbors_k']} ({time.perf_counter() - start:.2f}s)")
+    elif args.command == "status":
+        if not SimilarityIndex.exists():
+            print("インデックスがありません。")
+            return
+        index = SimilarityIndex.load()
+        print(f"docs: {index.meta['n_docs']} (appended: {index.meta.get('n_appended', 0)}), terms: {index.meta['n_terms']}, neighbors_k: {index.meta.get('neighbors_k')}, stale: {index.is_stale()}")
+
+if __name__ == "__main__":
+    main()
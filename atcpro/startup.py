@@ -0,0 +1,106 @@
+import builtins
+import importlib
+import os
+import sys
+import threading
+import time
+
+PROCESS_START = time.perf_counter() # 最初にimportされた時刻を起動時刻とみなす
+TIME_TO_WINDOW_TARGET = 1.5 # 秒。ウィンドウが表示されるまでの目標(環境変数STARTUP_TARGETで変更できる)
+# ウィンドウを表示した後に裏で読み込んでおく重いモジュール
+WARMUP_MODULES = ("bs4", "scipy.sparse", "sklearn.feature_extraction.text", "sklearn.preprocessing")
+
+milestones = [] # (名前, 起動からの秒数)[]
+
+def mark(name):
+    """
+    起動からの経過時間を記録する
+    """
+    elapsed = time.perf_counter() - PROCESS_START
+    milestones.append((name, elapsed))
+    return elapsed
+
+class ImportProfiler:
+    """
+    with内のimportにかかった時間をモジュールごとに記録する
+    max_depth: 何段目のimportまで記録するか(中でimportされたモジュールの時間は呼び出し元にも含まれる)
+    """
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.records = [] # (開始順, 深さ, モジュール名, 秒数)[]
+        self.local = threading.local()
+        self.original = None
+
+    def __enter__(self):
+        self.original = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc):
+        builtins.__import__ = self.original
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        depth = getattr(self.local, "depth", 0)
+        if depth >= self.max_depth or level > 0 or name in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+        order = len(self.records)
+        self.records.append(None)
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            self.local.depth = depth
+            self.records[order] = (order, depth, name, time.perf_counter() - start)
+
+    def report(self):
+        """
+        モジュールごとのimport時間の文字列(読み込んだ順、入れ子はインデント)
+        """
+        lines = []
+        for record in self.records:
+            if record is None:
+                continue
+            _order, depth, name, elapsed = record
+            lines.append(f"{'  ' * (depth + 2)}{name}: {elapsed * 1000:.1f}ms")
+        return "\n".join(lines)
+
+def warm_up(modules=WARMUP_MODULES):
+    """
+    重いモジュールを別スレッドで読み込んでおく(初めて使うときに待たないようにする)
+    return { モジュール名: 秒数 } (スレッドが終わると埋まる), スレッド
+    """
+    timings = {}
+    def run():
+        for name in modules:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                continue
+            timings[name] = time.perf_counter() - start
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return timings, thread
+
+def report(profiler=None, warm_up_timings=None):
+    """
+    起動時間の文字列(import時間の内訳と、ウィンドウが表示されるまでの時間と目標、裏で読み込んだモジュールの時間)
+    warm_up_timings: warm_upが返したタイミング
+    """
+    lines = ["startup:"]
+    if profiler is not None:
+        lines.append("  imports:")
+        lines.append(profiler.report())
+    for name, elapsed in milestones:
+        lines.append(f"  {name}: {elapsed:.3f}s")
+    target = float(os.getenv("STARTUP_TARGET", TIME_TO_WINDOW_TARGET))
+    shown = dict(milestones).get("window_shown")
+    if shown is not None:
+        lines.append(f"  time to window: {shown:.3f}s (target {target:.3f}s, {'OK' if shown <= target else 'OVER'})")
+    if warm_up_timings:
+        lines.append("  warm up (after window shown):")
+        for name, elapsed in warm_up_timings.items():
+            lines.append(f"    {name}: {elapsed * 1000:.1f}ms")
+    return "\n".join(lines)
@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+import time
+
+MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
+SUBMISSION_DB_PATH = "data/submissions.sqlite3"
+SUBMISSION_KEYS = ("id", "epoch_second", "problem_id", "contest_id", "user_id", "language", "point", "length", "result", "execution_time")
+PAGE_SIZE = 500 # kenkoooo APIが1回に返す最大件数
+
+class SubmissionStore:
+    """
+    ユーザーの提出をローカルに保存する(SQLite)
+    最後に保存した提出以降だけを取得して追加する
+    """
+
+    def __init__(self, path=SUBMISSION_DB_PATH):
+        self.path = os.path.join(MODULE_PATH, path)
+        self.local = threading.local()
+        self.sync_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self.connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS submissions (
+                id INTEGER PRIMARY KEY,
+                epoch_second INTEGER NOT NULL,
+                problem_id TEXT NOT NULL,
+                contest_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                language TEXT,
+                point REAL,
+                length INTEGER,
+                result TEXT,
+                execution_time INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS submissions_user_epoch ON submissions (user_id, epoch_second);
+            DROP INDEX IF EXISTS submissions_user_contest; -- contest_window用だったもの
+            CREATE TABLE IF NOT EXISTS sync_state (
+                user_id TEXT PRIMARY KEY,
+                synced_from INTEGER NOT NULL, -- この時刻以降の提出は保存済み
+                synced_at INTEGER NOT NULL -- 最後に同期した時刻
+            );
+        """)
+
+    def connection(self):
+        """
+        スレッドごとのコネクション
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def sync_state(self, user):
+        row = self.connection().execute("SELECT synced_from, synced_at FROM sync_state WHERE user_id = ?", (user,)).fetchone()
+        return None if row is None else (row["synced_from"], row["synced_at"])
+
+    def add(self, submissions):
+        """
+        提出を保存する(保存済みの提出は無視)
+        return 追加した件数
+        """
+        conn = self.connection()
+        before = conn.total_changes
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                f"INSERT OR IGNORE INTO submissions ({', '.join(SUBMISSION_KEYS)}) VALUES ({', '.join('?' * len(SUBMISSION_KEYS))})",
+                [tuple(submission.get(key) for key in SUBMISSION_KEYS) for submission in submissions]
+            )
+        return conn.total_changes - before
+
+    def sync(self, user, from_second, until=None, fetch=None, cancel=None):
+        """
+        from_second以降の提出が揃うように、保存済みの最後の提出以降を取得する
+        until: この時刻までの提出が必要(最後の同期がこれより後なら通信しない)
+        fetch: fetch(user, from_second) で提出を取得する関数(省略するとkenkoooo API)
+        cancel: threading.Event。セットされたらページの取得の合間にPipelineCancelledを投げる(同期状態は更新しない)
+        return 追加した件数
+        """
+        from cassette import bypass_caches
+        from pipeline import check_cancelled
+        if fetch is None:
+            from main import get_user_submissions as fetch
+
+        with self.sync_lock:
+            # 記録・再生時は保存済みの範囲を使わずにfrom_secondから取得する
+            state = None if bypass_caches() else self.sync_state(user)
+            if state is not None and state[0] <= from_second and (until is not None and state[1] >= until):
+                return 0
+
+            conn = self.connection()
+            last = conn.execute("SELECT MAX(epoch_second) FROM submissions WHERE user_id = ?", (user,)).fetchone()[0]
+            skip_from = None
+            if state is None or from_second < state[0]:
+                # 保存済みの範囲より前から必要な場合はfrom_secondから取得し、
+                # 保存済みの範囲(state[0]~最後の提出)に入ったら最後の提出まで飛ばす
+                cursor = from_second
+                synced_from = from_second
+                if state is not None and last is not None:
+                    skip_from = state[0]
+            else:
+                cursor = from_second if last is None else max(from_second, last)
+                synced_from = state[0]
+
+            synced_at = int(time.time())
+            added = 0
+            while True:
+                check_cancelled(cancel)
+                submissions = fetch(user, cursor)
+                if submissions is None:
+                    # 取得に失敗した場合は同期状態を更新しない
+                    return added
+                added += self.add(submissions)
+                # 最後のページ(PAGE_SIZE未満)まで取得して追いついたことにする
+                if len(submissions) < PAGE_SIZE:
+                    break
+                next_cursor = max(submission["epoch_second"] for submission in submissions)
+                if skip_from is not None and next_cursor >= skip_from:
+                    next_cursor = max(next_cursor, last)
+                    skip_from = None
+                # 1ページ全てが同じ時刻の場合に同じページを取り続けないようにする
+                cursor = next_cursor if next_cursor > cursor else cursor + 1
+
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (user_id, synced_from, synced_at) VALUES (?, ?, ?)",
+                    (user, synced_from, synced_at)
+                )
+            return added
+
+    def between(self, user, start, end):
+        """
+        start <= epoch_second <= end のユーザーの提出(時刻順)
+        """
+        rows = self.connection().execute(
+            "SELECT * FROM submissions WHERE user_id = ? AND epoch_second BETWEEN ? AND ? ORDER BY epoch_second, id",
+            (user, start, end)
+        )
+        return [dict(row) for row in rows]
+
+_store = None
+_store_lock = threading.Lock()
+def get_submission_store():
+    """
+    プロセス内で共有するSubmissionStoreを取得する
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SubmissionStore()
+        return _store
+
+def check_backfill():
+    """
+    保存済みの範囲より前から同期し直したときに、最後の同期以降の提出まで揃うかを確認する
+    """
+    import tempfile
+
+    # 1000~19000秒に10秒ごとの提出(1801件)。最初の同期の時点では12000秒までしかない
+    submissions = [
+        {"id": i, "epoch_second": 1000 + 10 * i, "problem_id": "abc001_a", "contest_id": "abc001", "user_id": "user", "result": "AC"}
+        for i in range(1801)
+    ]
+    now = [12000]
+    def fetch(user, from_second):
+        return [s for s in submissions if from_second <= s["epoch_second"] <= now[0]][:PAGE_SIZE]
+
+    with tempfile.TemporaryDirectory() as path:
+        store = SubmissionStore(f"{path}/submissions.sqlite3")
+        store.sync("user", 2000, fetch=fetch)
+        now[0] = 19000
+        store.sync("user", 1000, until=19000, fetch=fetch)
+        stored = len(store.between("user", 0, 10**10))
+        store.connection().close()
+    print(f"stored: {stored}/{len(submissions)} {'OK' if stored == len(submissions) else 'NG'}")
+    return stored == len(submissions)
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(0 if check_backfill() else 1)
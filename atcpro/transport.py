@@ -0,0 +1,135 @@
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from cassette import get_cassette
+from ratelimit import TokenBucket
+
+# ホストごとの1秒あたりのリクエスト数の上限(ないホストは制限しない)
+HOST_RATES = {
+    "atcoder.jp": 1.0,
+    "kenkoooo.com": 1.0,
+}
+DEFAULT_TIMEOUT = (5, 60) # (接続, 読み込み)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class Transport:
+    """
+    kenkoooo, AtCoder, Geminiへのリクエストの共通処理
+    - ホストごとにコネクションを再利用する
+    - ホストごとのトークンバケットでアクセス間隔を守る
+    - タイムアウトと回数制限付きのリトライ(指数バックオフ)
+    - cassetteがあれば通信を記録・再生する(cassette.pyを参照)
+    """
+
+    def __init__(self, host_rates=HOST_RATES, timeout=DEFAULT_TIMEOUT, retries=3, backoff=1.0, cassette=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiters = {host: TokenBucket(rate) for host, rate in host_rates.items()}
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "waited": 0.0}
+        self.cassette = get_cassette() if cassette is None else cassette
+
+    def set_rate(self, host, rate):
+        """
+        hostのレート制限を変更する(rateがNoneなら制限しない)
+        """
+        with self.lock:
+            if rate is None:
+                self.limiters.pop(host, None)
+            else:
+                self.limiters[host] = TokenBucket(rate)
+
+    def wait(self, url):
+        """
+        urlのホストのレート制限に従って待つ
+        """
+        limiter = self.limiters.get(urlsplit(url).hostname)
+        if limiter is None:
+            return
+        waited = limiter.acquire()
+        with self.lock:
+            self.counters["waited"] += waited
+
+    def request(self, method, url, **kwargs):
+        """
+        リクエストを送る(再生モードなら記録したレスポンスを返す)
+        再生時もレート制限には従うので、実際の通信と同じような時間がかかる
+        """
+        if self.cassette is not None and self.cassette.mode == "replay":
+            self.wait(url)
+            with self.lock:
+                self.counters["requests"] += 1
+            return self.cassette.replay(method, url, kwargs)
+        res, sent_at = self.send(method, url, **kwargs)
+        if self.cassette is not None:
+            # 最後の送信から本文を受け取るまでの時間を記録する(レート制限とリトライの待ち時間は再生時に改めてかかるので含めない)
+            res.content
+            return self.cassette.record(method, url, kwargs, res, time.perf_counter() - sent_at)
+        return res
+
+    def send(self, method, url, **kwargs):
+        """
+        リクエストを送る(接続エラーとRETRY_STATUSの場合はリトライする)
+        return (レスポンス, 最後に送信した時刻)
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            self.wait(url)
+            with self.lock:
+                self.counters["requests"] += 1
+            sent_at = time.perf_counter()
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            else:
+                if not res.status_code in RETRY_STATUS or attempt == self.retries:
+                    return res, sent_at
+                delay = self.retry_after(res, self.backoff * 2 ** attempt)
+            with self.lock:
+                self.counters["retries"] += 1
+            time.sleep(delay)
+
+    @staticmethod
+    def retry_after(res, default):
+        """
+        Retry-Afterヘッダーがあればその秒数
+        """
+        try:
+            return float(res.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return default
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            ret = dict(self.counters)
+        if self.cassette is not None:
+            ret.update(self.cassette.stats())
+        return ret
+
+_transport = None
+_transport_lock = threading.Lock()
+def get_transport():
+    """
+    プロセス内で共有するTransportを取得する
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport